@@ -1,10 +1,139 @@
 import json
+import math
+import time
 import base64
+import asyncio
 import logging
+import threading
+from collections import deque
 from io import BytesIO
-from types import SimpleNamespace
 
 import httpx
+
+try:
+    # httpx 的HTTP/2支持依赖 h2（随 httpx[http2] 安装），缺少时使用HTTP/1.1
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+class LatencyStats:
+    """
+    每个AI最近若干次请求的首字耗时（滚动窗口），用于按速度排序AI和决定何时发出备用请求
+    （在事件循环线程中记录，在界面线程中读取）
+    只记录实际收到的首字耗时；没有首字就出错、超时或被更快的AI取消的请求另行计数，不计入分位数
+    """
+
+    def __init__(self, window=50, min_samples=5):
+        self.window = window
+        # 样本少于该数量时不给出分位数
+        self.min_samples = min_samples
+        # {AI名称: deque[首字耗时（秒）]}
+        self._samples = {}
+        # {AI名称: deque[请求结果]}，结果为 "ok"（收到首字）、"failed"（没有首字就出错或超时）、"lost"（没有首字就被取消）
+        self._outcomes = {}
+        self._lock = threading.Lock()
+
+    def _append(self, table, ai_name, value):
+        items = table.get(ai_name)
+        if items is None:
+            items = table[ai_name] = deque(maxlen=self.window)
+        items.append(value)
+
+    def record(self, ai_name, seconds):
+        """记录一次实际收到的首字耗时"""
+        with self._lock:
+            self._append(self._samples, ai_name, seconds)
+            self._append(self._outcomes, ai_name, "ok")
+
+    def record_failure(self, ai_name):
+        """记录一次没有首字就出错或超时的请求"""
+        with self._lock:
+            self._append(self._outcomes, ai_name, "failed")
+
+    def record_loss(self, ai_name):
+        """记录一次还没有首字就被更快的AI取消的请求"""
+        with self._lock:
+            self._append(self._outcomes, ai_name, "lost")
+
+    def forget(self, ai_name):
+        with self._lock:
+            self._samples.pop(ai_name, None)
+            self._outcomes.pop(ai_name, None)
+
+    def percentile(self, ai_name, q):
+        """
+        :param q: 分位（0~1），如 0.5、0.95
+        :return: 首字耗时的q分位数（秒，取最近的实际样本），样本不足 min_samples 时返回None
+        """
+        with self._lock:
+            samples = sorted(self._samples.get(ai_name, ()))
+        if len(samples) < self.min_samples:
+            return None
+        return samples[max(0, math.ceil(q * len(samples)) - 1)]
+
+    def rank(self, ai_name):
+        """
+        排序键，越小越靠前：
+        最近的请求中过半没有首字就失败的AI排在最后；
+        结果不足 min_samples 次的AI排在最前，以便尽快积累样本；
+        其余有足够首字样本的按中位数从快到慢排列，多次落后、始终没有足够首字样本的排在它们之后
+        """
+        with self._lock:
+            outcomes = list(self._outcomes.get(ai_name, ()))
+        unreliable = len(outcomes) >= self.min_samples and outcomes.count("failed") * 2 > len(outcomes)
+        if len(outcomes) < self.min_samples:
+            return (unreliable, 0, 0.0)
+        p50 = self.percentile(ai_name, 0.5)
+        if p50 is None:
+            return (unreliable, 2, 0.0)
+        return (unreliable, 1, p50)
+
+
+class AnswerRun:
+    """
+    一次提问向多个AI发出的请求：在后台事件循环中运行，可从任意线程整体或按服务商取消
+    """
+
+    def __init__(self, loop):
+        self._loop = loop
+        # {AI名称: asyncio.Task}，只在事件循环线程中访问
+        self._tasks = {}
+        # 请求开始前就被取消的AI名称，None表示全部取消
+        self._cancelled = set()
+        # 整个提问的 concurrent.futures.Future
+        self.future = None
+        # {AI名称: 首字耗时（秒）}
+        self.ttft = {}
+        # 抢答模式下第一个给出明确答案的AI名称及其答案
+        self.winner = None
+        self.answer = None
+        # 对冲请求：主AI与备用AI之间先出首字者胜出，另一个立即取消
+        self.hedged = False
+        # {AI名称: asyncio.Event}，收到首字时置位，只在事件循环线程中访问
+        self._first_token = {}
+
+    def cancel(self, ai_name=None):
+        """
+        取消请求，已建立的流式连接随之关闭
+        :param ai_name: 要取消的AI名称，None表示取消全部
+        """
+        if not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._cancel, ai_name)
+
+    def _cancel(self, ai_name):
+        self._cancelled.add(ai_name)
+        for name, task in self._tasks.items():
+            if ai_name is None or name == ai_name:
+                task.cancel()
+
+    def is_cancelled(self, ai_name):
+        return None in self._cancelled or ai_name in self._cancelled
+
+    def done(self):
+        return self.future is not None and self.future.done()
+
 
 class AIManager:
     DEFAULT_PROMPT = """你是一个专业的问题回答助手。请根据用户提供的题目，给出准确、详细的答案。
@@ -18,6 +147,21 @@ class AIManager:
 
 请直接回答问题，不需要额外的寒暄。"""
 
+    # 连接池中空闲连接的保活时间（秒），两道题之间的间隔内连接保持可用
+    KEEPALIVE_EXPIRY = 120.0
+    # 每个客户端保留的空闲连接数
+    MAX_KEEPALIVE_CONNECTIONS = 4
+    # 默认预热间隔（秒）：打开截图区域后按此间隔重复预热，0表示不预热；应小于 KEEPALIVE_EXPIRY
+    DEFAULT_WARMUP_INTERVAL = 60
+    # 预热请求的超时（秒）
+    WARMUP_TIMEOUT = 5.0
+    # 单个AI从发出请求到回答完毕的默认期限（秒），可在AI配置中用 deadline 覆盖
+    DEFAULT_DEADLINE = 90.0
+    # 流式回答推送给界面的批处理间隔（秒）：同一批内的增量合并后一次交给回调
+    BATCH_INTERVAL = 0.05
+    # 对冲模式下主AI还没有足够的首字耗时样本时，等待多久（秒）发出备用请求
+    DEFAULT_HEDGE_DELAY = 3.0
+
     def __init__(self):
         # AI配置字典，格式：{name: config_dict}
         self.ai_configs = {}
@@ -28,6 +172,24 @@ class AIManager:
             "qwen-vl-plus", "qwen-vl-max",
             "claude-3-opus-20240229", "claude-3-sonnet-20240229", "claude-3-haiku-20240307",
         ]
+        # 长连接客户端池：{(base_url, 代理, 超时, 是否HTTP/2): httpx.AsyncClient}，跨题目复用TCP/TLS连接；
+        # 只在事件循环线程中访问
+        self._clients = {}
+        # 各客户端共用的SSL上下文：每个客户端单独加载证书需要数十毫秒，会阻塞事件循环
+        self._ssl_context = None
+        # 所有AI请求共用的事件循环，运行在一个后台线程中，首次使用时启动
+        self._loop = None
+        self._loop_thread = None
+        self._loop_lock = threading.Lock()
+        self.warmup_interval = self.DEFAULT_WARMUP_INTERVAL
+        # 抢答模式：第一个给出明确答案的AI胜出，其余AI的回答立即取消
+        self.race_mode = True
+        # 对冲模式：只向最快的AI提问，到它的首字耗时p95仍无首字时再向次快的AI发出备用请求
+        self.hedge_mode = False
+        # 各AI的首字耗时统计，决定 get_enabled_ais 的顺序和对冲时机
+        self.latency = LatencyStats()
+        # {base_url: 上次预热的时间}
+        self._warmed = {}
         
     def load_settings(self, settings):
         """
@@ -46,6 +208,21 @@ class AIManager:
             if not isinstance(settings["system_prompt"], str):
                 raise ValueError("系统提示词必须是字符串")
             self.system_prompt = settings["system_prompt"]
+
+        if "warmup_interval" in settings:
+            if not isinstance(settings["warmup_interval"], (int, float)) or settings["warmup_interval"] < 0:
+                raise ValueError("预热间隔必须是非负数")
+            self.warmup_interval = settings["warmup_interval"]
+
+        if "race_mode" in settings:
+            if not isinstance(settings["race_mode"], bool):
+                raise ValueError("抢答模式必须是布尔值")
+            self.race_mode = settings["race_mode"]
+
+        if "hedge_mode" in settings:
+            if not isinstance(settings["hedge_mode"], bool):
+                raise ValueError("对冲模式必须是布尔值")
+            self.hedge_mode = settings["hedge_mode"]
         
     def get_settings(self):
         """
@@ -54,7 +231,10 @@ class AIManager:
         """
         return {
             "configs": self.ai_configs.copy(),
-            "system_prompt": self.system_prompt
+            "system_prompt": self.system_prompt,
+            "warmup_interval": self.warmup_interval,
+            "race_mode": self.race_mode,
+            "hedge_mode": self.hedge_mode,
         }
         
     def add_ai_config(self, name, config):
@@ -84,6 +264,7 @@ class AIManager:
         """
         if name in self.ai_configs:
             del self.ai_configs[name]
+            self.latency.forget(name)
             return True
         return False
         
@@ -97,31 +278,220 @@ class AIManager:
         return config.copy() if config else None
             
     def get_enabled_ais(self):
-        """获取启用的AI配置"""
-        return {name: config for name, config in self.ai_configs.items() 
-                if config.get("enabled", False)}
+        """
+        获取启用的AI配置，按最近的首字耗时中位数从快到慢排列（见 LatencyStats.rank）；
+        样本不足的AI排在最前（保持配置顺序），以便尽快积累样本，经常失败的AI排在最后
+        """
+        enabled = [(name, config) for name, config in self.ai_configs.items()
+                   if config.get("enabled", False)]
+        return dict(sorted(enabled, key=lambda item: self.latency.rank(item[0])))
                 
-    def get_answer(self, ai_name, config, question_text, image=None):
+    def ask_all(self, configs, question_text, image=None, on_events=None, answer_parser=None):
         """
-        获取AI回答（调度器）
-        :param ai_name: AI名称
-        :param config: AI配置
+        向多个AI并发提问（数量不限），所有请求在同一个后台事件循环中流式进行，每个AI有独立的期限并可单独取消；
+        对冲模式下只向前两个AI提问，第二个作为备用请求按需发出
+        :param configs: {AI名称: AI配置}，按优先顺序排列（通常为 get_enabled_ais 的结果）
         :param question_text: 题目文本
-        :param image: 题目图片（可选）
-        :return: AI回答
+        :param image: 题目图片（可选，只发给支持图片的模型）
+        :param on_events: 回调 on_events(run, events)，在事件循环线程中每 BATCH_INTERVAL 秒最多调用一次；
+                          events 为 [(AI名称, 类型, 文本)]，类型为 "started"（开始请求，备用请求的文本为 "hedge"）、
+                          "delta"（回答增量，同一AI的连续增量已合并）、
+                          "done"（完整回答）、"error"（错误信息）、"cancelled"（取消前已收到的回答）
+                          或 "won"（抢答胜出，文本为解析出的答案）
+        :param answer_parser: 抢答模式的回答解析函数 answer_parser(回答文本, 回答是否已结束)，返回答案或None；
+                              给出时第一个解析出答案的AI胜出，其余AI的请求立即取消并关闭连接
+        :return: AnswerRun
         """
-        ai_type = config.get("type", "openai").lower()
-        model = config.get("model")
+        if not any(config.get("model") in self.vision_models for config in configs.values()):
+            image = None
+
+        run = AnswerRun(self._ensure_loop())
+        run.hedged = self.hedge_mode and len(configs) > 1
+        run.future = self._submit(
+            self._fan_out(run, dict(configs), question_text, image, on_events, answer_parser)
+        )
+        return run
+
+    async def _fan_out(self, run, configs, question_text, image, on_events, answer_parser):
+        # 图片编码较慢，放到线程池中进行，不占用调用方（界面线程）和事件循环
+        image_base64 = None
+        if image is not None:
+            try:
+                image_base64 = await asyncio.get_running_loop().run_in_executor(None, self._encode_image, image)
+            except Exception as e:
+                logging.warning(f"图片处理失败，只发送识别的文字: {e}")
+
+        events = []
 
-        if image and model in self.vision_models:
-            return self._get_openai_compatible_answer(config, question_text, image)
+        def flush():
+            if not events:
+                return
+            batch = self._coalesce(events)
+            events.clear()
+            if on_events is None:
+                return
+            try:
+                on_events(run, batch)
+            except Exception as e:
+                logging.warning(f"推送AI回答失败: {e}", exc_info=True)
+
+        async def flush_periodically():
+            while True:
+                await asyncio.sleep(self.BATCH_INTERVAL)
+                flush()
+
+        def start(ai_name, label=""):
+            if run.is_cancelled(ai_name):
+                return
+            run._first_token[ai_name] = asyncio.Event()
+            events.append((ai_name, "started", label))
+            run._tasks[ai_name] = asyncio.ensure_future(
+                self._answer_one(run, ai_name, configs[ai_name], question_text, image_base64, events, answer_parser)
+            )
+
+        flusher = asyncio.ensure_future(flush_periodically())
+        try:
+            if run.hedged:
+                primary, backup = list(configs)[:2]
+                start(primary)
+                # 主AI在开始前就被取消时不再等待首字
+                if primary in run._tasks and await self._needs_hedge(run, primary):
+                    start(backup, "hedge")
+            else:
+                for ai_name in configs:
+                    start(ai_name)
+            await asyncio.gather(*run._tasks.values(), return_exceptions=True)
+        finally:
+            flusher.cancel()
+            flush()
+
+    async def _answer_one(self, run, ai_name, config, question_text, image_base64, events, answer_parser):
+        """流式获取一个AI的回答并写入 events，超过期限或被取消时关闭连接"""
+        deadline = float(config.get("deadline", self.DEFAULT_DEADLINE))
+        parts = []
+        start = time.monotonic()
+
+        async def consume():
+            async for delta in self.stream_answer(config, question_text, image_base64):
+                if not parts:
+                    self._first_token_arrived(run, ai_name, time.monotonic() - start)
+                parts.append(delta)
+                events.append((ai_name, "delta", delta))
+                if answer_parser is not None and run.winner is None:
+                    answer = answer_parser("".join(parts), False)
+                    if answer is not None:
+                        self._promote(run, ai_name, answer, events)
+
+        logging.info(f"AI({ai_name}) - 开始请求")
+        try:
+            await asyncio.wait_for(consume(), deadline)
+        except asyncio.CancelledError:
+            logging.info(f"AI({ai_name}) - 已取消")
+            events.append((ai_name, "cancelled", "".join(parts)))
+            raise
+        except asyncio.TimeoutError:
+            logging.warning(f"AI({ai_name}) - 超过 {deadline:g} 秒未完成，已停止")
+            events.append((ai_name, "error", f"超过{deadline:g}秒未完成，已停止"))
+            if not parts:
+                self.latency.record_failure(ai_name)
+        except Exception as e:
+            logging.error(f"AI({ai_name})错误: {e}", exc_info=True)
+            events.append((ai_name, "error", str(e)))
+            # 没有给出首字就出错的AI单独计数（不计入首字耗时），经常失败时排到后面
+            if not parts:
+                self.latency.record_failure(ai_name)
         else:
-            return self._get_openai_compatible_answer(config, question_text)
+            full_answer = "".join(parts)
+            if full_answer.strip():
+                # 限制日志长度，只记录前500字符
+                log_answer = full_answer[:500] + "..." if len(full_answer) > 500 else full_answer
+                logging.info(f"AI({ai_name}) - 回答: {log_answer}")
+            else:
+                logging.warning(f"AI({ai_name}) - 回答为空")
+            events.append((ai_name, "done", full_answer))
+            if answer_parser is not None and run.winner is None:
+                answer = answer_parser(full_answer, True)
+                if answer is not None:
+                    self._promote(run, ai_name, answer, events)
+
+    async def _needs_hedge(self, run, primary):
+        """
+        等待主AI的首字，最长等到它首字耗时的p95（样本不足时为 DEFAULT_HEDGE_DELAY）
+        :return: 主AI到时仍无首字（或已失败）、需要发出备用请求时返回True
+        """
+        delay = self.latency.percentile(primary, 0.95) or self.DEFAULT_HEDGE_DELAY
+        first_token = run._first_token[primary]
+        waiter = asyncio.ensure_future(first_token.wait())
+        try:
+            await asyncio.wait({waiter, run._tasks[primary]}, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            waiter.cancel()
+        if first_token.is_set() or run.is_cancelled(None):
+            return False
+        logging.info(f"AI({primary}) - {delay:.2f} 秒内没有首字，发出备用请求")
+        return True
 
-    def _get_openai_compatible_answer(self, config, question_text, image=None):
-        """获取与OpenAI API兼容的服务的回答"""
+    def _first_token_arrived(self, run, ai_name, ttft):
+        """记录首字耗时；对冲请求中先出首字者胜出，取消另一个还没有首字的请求"""
+        run.ttft[ai_name] = ttft
+        run._first_token[ai_name].set()
+        self.latency.record(ai_name, ttft)
+        if not run.hedged:
+            return
+        for name, task in run._tasks.items():
+            if name != ai_name and name not in run.ttft and not task.done():
+                logging.info(f"AI({ai_name}) - 首字耗时 {ttft:.2f} 秒，先于 {name}，取消 {name} 的请求")
+                self._cancel_slower(run, name)
+
+    def _cancel_slower(self, run, ai_name):
+        """取消落后的AI；还没有首字时记为一次落后（实际首字耗时未知，不计入首字耗时）"""
+        if ai_name not in run.ttft:
+            self.latency.record_loss(ai_name)
+        run._tasks[ai_name].cancel()
+
+    def _promote(self, run, ai_name, answer, events):
+        """抢答：ai_name 第一个给出明确答案，取消其余仍在回答的AI（流式连接随之关闭）"""
+        run.winner, run.answer = ai_name, answer
+        events.append((ai_name, "won", answer))
+        losers = [name for name, task in run._tasks.items() if name != ai_name and not task.done()]
+        logging.info(
+            f"AI({ai_name}) - 抢答胜出: {answer}，首字耗时 {run.ttft[ai_name]:.2f} 秒，取消 {len(losers)} 个较慢的回答"
+        )
+        for name in losers:
+            self._cancel_slower(run, name)
+
+    @staticmethod
+    def _coalesce(events):
+        """合并同一AI的连续增量，各AI自身的事件顺序不变"""
+        merged = []
+        # {AI名称: 该AI最后一个增量在 merged 中的下标}，之后出现该AI的其他事件时失效
+        open_delta = {}
+        for ai_name, kind, text in events:
+            if kind == "delta":
+                pos = open_delta.get(ai_name)
+                if pos is not None:
+                    merged[pos] = (ai_name, kind, merged[pos][2] + text)
+                    continue
+                open_delta[ai_name] = len(merged)
+            else:
+                open_delta.pop(ai_name, None)
+            merged.append((ai_name, kind, text))
+        return merged
+
+    @staticmethod
+    def _encode_image(image):
+        buffered = BytesIO()
+        image.save(buffered, format="PNG")
+        return base64.b64encode(buffered.getvalue()).decode()
+
+    async def stream_answer(self, config, question_text, image_base64=None):
+        """
+        流式获取与OpenAI API兼容的服务的回答（在事件循环线程中调用）
+        :param image_base64: PNG图片的base64编码，模型支持图片时随题目发送
+        :return: 异步生成器，逐段产出回答文本
+        """
         api_key = config.get("api_key")
-        base_url = config.get("base_url", "").strip()
+        base_url = self._resolve_base_url(config)
         model = config.get("model")
 
         if not api_key:
@@ -129,37 +499,26 @@ class AIManager:
         if not model:
             raise ValueError("模型未配置")
 
-        # 如果是官方openai且未指定base_url，则使用默认值
-        if config.get("type") == "openai" and not base_url:
-            base_url = "https://api.openai.com/v1"
-
         messages = [
             {"role": "system", "content": self.system_prompt},
         ]
 
-        if image and model in self.vision_models:
-            try:
-                buffered = BytesIO()
-                image.save(buffered, format="PNG")
-                img_base64 = base64.b64encode(buffered.getvalue()).decode()
-
-                messages.append({
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": f"请回答图片中的题目。如果图片中有文字题目，请优先使用图片内容。识别到的文字内容：{question_text}"
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/png;base64,{img_base64}"
-                            }
+        if image_base64 and model in self.vision_models:
+            messages.append({
+                "role": "user",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": f"请回答图片中的题目。如果图片中有文字题目，请优先使用图片内容。识别到的文字内容：{question_text}"
+                    },
+                    {
+                        "type": "image_url",
+                        "image_url": {
+                            "url": f"data:image/png;base64,{image_base64}"
                         }
-                    ]
-                })
-            except Exception as e:
-                raise Exception(f"图片处理失败: {str(e)}")
+                    }
+                ]
+            })
         else:
             messages.append({
                 "role": "user",
@@ -184,15 +543,71 @@ class AIManager:
         if extra_args:
             payload.update(extra_args)
 
+        headers = {
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json",
+        }
+        url = base_url.rstrip("/") + "/chat/completions"
+        client = self._client_for_config(base_url, config)
+
         try:
-            return self._stream_chat_completion(base_url, api_key, payload, config)
-        except Exception as e:
-            if isinstance(e, ValueError):
-                raise e
-            raise Exception(f"OpenAI API错误: {str(e)}")
+            # 提前退出（取消、超过期限）时离开 async with 即关闭响应，未读完的连接不会放回连接池
+            async with client.stream("POST", url, headers=headers, json=payload) as response:
+                if response.is_error:
+                    await response.aread()
+                    raise ValueError(f"API调用失败: {response.text}")
+                done = False
+                async for line in response.aiter_lines():
+                    # [DONE] 之后继续读到流结束：完整读完的响应才能把连接放回连接池复用
+                    if done or not line:
+                        continue
+                    if line.startswith("data: "):
+                        line = line[6:]
+                    line = line.strip()
+                    if not line:
+                        continue
+                    if line == "[DONE]":
+                        done = True
+                        continue
+                    try:
+                        event = json.loads(line)
+                    except json.JSONDecodeError:
+                        logging.warning(f"无法解析的流式返回: {line}")
+                        continue
+                    delta = ""
+                    choices = event.get("choices", [])
+                    if choices:
+                        choice = choices[0]
+                        delta = choice.get("delta", {}).get("content") or choice.get("text", "")
+                    if delta:
+                        yield delta
+        except httpx.HTTPError as e:
+            raise ValueError(f"网络请求失败: {e}")
 
-    def _stream_chat_completion(self, base_url, api_key, payload, config):
-        """直接使用httpx与OpenAI兼容接口进行流式对话请求"""
+    def _ensure_loop(self):
+        """返回后台事件循环，尚未启动时启动"""
+        with self._loop_lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=loop.run_forever, name="ai-event-loop", daemon=True)
+                thread.start()
+                self._loop, self._loop_thread = loop, thread
+            return self._loop
+
+    def _submit(self, coro):
+        """把协程提交到后台事件循环，返回 concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(coro, self._ensure_loop())
+
+    @staticmethod
+    def _resolve_base_url(config):
+        """接口地址：官方openai未指定base_url时使用默认值"""
+        base_url = config.get("base_url", "").strip()
+        if config.get("type") == "openai" and not base_url:
+            base_url = "https://api.openai.com/v1"
+        return base_url
+
+    def _client_for_config(self, base_url, config):
+        """按AI配置中的超时、代理和HTTP/2设置从连接池取客户端"""
         timeout = float(config.get("timeout", 60)) if isinstance(config, dict) else 60
 
         proxies = None
@@ -200,58 +615,123 @@ class AIManager:
             proxies = config.get("proxies")
         proxies = self._normalize_proxies(proxies)
 
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json",
-        }
+        http2 = bool(config.get("http2", True)) if isinstance(config, dict) else True
+        return self._get_client(base_url, proxies, timeout, http2)
 
-        url = base_url.rstrip("/") + "/chat/completions"
+    def _get_client(self, base_url, proxies, timeout, http2=True):
+        """
+        从连接池获取（或创建）长连接客户端，同一服务商的请求复用已建立的连接（在事件循环线程中调用）
+        :param proxies: _normalize_proxies 处理后的代理字典
+        :param http2: 是否尝试HTTP/2（TLS握手时与服务端协商，不支持时自动使用HTTP/1.1）
+        """
+        http2 = http2 and HTTP2_AVAILABLE
+        key = (
+            base_url.rstrip("/"),
+            tuple(sorted(proxies.items())) if proxies else None,
+            timeout,
+            http2,
+        )
+        client = self._clients.get(key)
+        if client is not None and not client.is_closed:
+            return client
+        try:
+            client = self._create_client(proxies, timeout, http2)
+        except Exception as e:
+            raise ValueError(f"创建HTTP客户端失败: {e}")
+        self._clients[key] = client
+        logging.info(f"创建AI连接池: {key[0]}（{'HTTP/2' if http2 else 'HTTP/1.1'}）")
+        return client
 
-        client_kwargs = {"timeout": timeout}
+    def _create_client(self, proxies, timeout, http2):
+        limits = httpx.Limits(
+            max_keepalive_connections=self.MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=self.KEEPALIVE_EXPIRY,
+        )
+        if self._ssl_context is None:
+            self._ssl_context = httpx.create_ssl_context()
+        client_kwargs = {"timeout": timeout, "limits": limits, "http2": http2, "verify": self._ssl_context}
         if proxies:
-            client_kwargs["proxies"] = proxies
+            # 按协议挂载带代理的传输层（兼容不再支持 proxies 参数的新版 httpx）
+            client_kwargs["mounts"] = {
+                f"{scheme}://": httpx.AsyncHTTPTransport(
+                    proxy=proxy, http2=http2, limits=limits, verify=self._ssl_context,
+                )
+                for scheme, proxy in proxies.items()
+            }
+        return httpx.AsyncClient(**client_kwargs)
+
+    def warm_up(self):
+        """
+        预热所有已启用AI的连接：提前完成DNS/TCP/TLS握手并发送一次轻量的模型列表请求，
+        随后的提问直接使用已建立的连接；距上次预热不足 warmup_interval 秒的服务商跳过
+        （阻塞到预热完成，应在后台线程调用；各服务商在事件循环中并行预热）
+        """
+        if not self.warmup_interval:
+            return
+        now = time.monotonic()
+        due = {}
+        for config in self.get_enabled_ais().values():
+            base_url = self._resolve_base_url(config).rstrip("/")
+            if not base_url or not config.get("api_key"):
+                continue
+            if now - self._warmed.get(base_url, float("-inf")) >= self.warmup_interval:
+                due[base_url] = config
+        if not due:
+            return
+        # 先登记预热时间，避免重复触发时同时预热同一服务商；失败时撤销
+        for base_url in due:
+            self._warmed[base_url] = now
+        self._submit(self._warm_up_all(due)).result()
 
+    async def _warm_up_all(self, due):
+        await asyncio.gather(*(self._warm_up_endpoint(base_url, config) for base_url, config in due.items()))
+
+    async def _warm_up_endpoint(self, base_url, config):
+        start = time.monotonic()
         try:
-            client = httpx.Client(**client_kwargs)
+            client = self._client_for_config(base_url, config)
+            # 只关心连接是否建立，接口返回错误状态（如不支持模型列表）也不影响预热效果
+            await client.get(
+                base_url + "/models",
+                headers={"Authorization": f"Bearer {config['api_key']}"},
+                timeout=self.WARMUP_TIMEOUT,
+            )
+        except (ValueError, httpx.HTTPError) as e:
+            self._warmed.pop(base_url, None)
+            logging.info(f"预热AI连接失败 {base_url}: {e}")
+            return
+        logging.info(f"已预热AI连接 {base_url}，耗时 {time.monotonic() - start:.2f} 秒")
+
+    def close(self):
+        """取消进行中的请求，关闭连接池中的所有客户端并停止后台事件循环（应用退出时调用）"""
+        with self._loop_lock:
+            loop, thread = self._loop, self._loop_thread
+            self._loop = self._loop_thread = None
+        self._warmed.clear()
+        if loop is None:
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self._close_clients(), loop).result(timeout=5)
         except Exception as e:
-            raise ValueError(f"创建HTTP客户端失败: {e}")
+            logging.warning(f"关闭HTTP客户端失败: {e}")
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout=5)
+        if not thread.is_alive():
+            loop.close()
 
-        def _iter_stream():
+    async def _close_clients(self):
+        pending = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+        clients = list(self._clients.values())
+        self._clients.clear()
+        for client in clients:
             try:
-                with client.stream("POST", url, headers=headers, json=payload) as response:
-                    response.raise_for_status()
-                    for line in response.iter_lines():
-                        if not line:
-                            continue
-                        if line.startswith("data: "):
-                            line = line[6:]
-                        line = line.strip()
-                        if not line:
-                            continue
-                        if line == "[DONE]":
-                            break
-                        try:
-                            event = json.loads(line)
-                        except json.JSONDecodeError:
-                            logging.warning(f"无法解析的流式返回: {line}")
-                            continue
-                        delta = ""
-                        choices = event.get("choices", [])
-                        if choices:
-                            choice = choices[0]
-                            delta = choice.get("delta", {}).get("content") or choice.get("text", "")
-                        yield SimpleNamespace(
-                            choices=[SimpleNamespace(delta=SimpleNamespace(content=delta or ""))]
-                        )
-            except httpx.HTTPStatusError as e:
-                detail = e.response.text
-                raise ValueError(f"API调用失败: {detail}")
-            except httpx.HTTPError as e:
-                raise ValueError(f"网络请求失败: {e}")
-            finally:
-                client.close()
-
-        return _iter_stream()
+                await client.aclose()
+            except Exception as e:
+                logging.warning(f"关闭HTTP客户端失败: {e}")
 
     def _normalize_proxies(self, proxies):
         if not proxies:
@@ -0,0 +1,80 @@
+"""
+回答解析：从AI的流式回答中尽早识别出明确的答案（选项字母或诗句），用于多个AI抢答
+流式回答尚未结束时，只接受后面已经出现其他字符的答案，避免把还在输出中的诗句当成完整答案
+"""
+import re
+from collections import Counter
+
+# 诗句答案的最少字数
+MIN_CLAUSE_CHARS = 4
+
+# 选项字母：“答案是B”“选C”“正确答案：（A）”，或回答以选项字母开头“B. 杜甫”
+_OPTION = re.compile(
+    r"(?:正确答案|答案|应选|选择|选)\s*(?:应该是|应为|是|为)?\s*[:：]?\s*[*（(【\[]*\s*(?P<letter>[A-Da-d])(?![A-Za-z])"
+    r"|^\s*[*（(【\[]*(?P<lead>[A-D])(?=[)）】\]*．.、:：\s])"
+)
+# 以标点、空白或引号分隔的一段汉字
+_HAN_RUN = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+")
+
+
+def parse_option(text, complete=True):
+    """
+    :param complete: 回答是否已经结束；未结束时选项字母之后必须已有其他字符
+    :return: 大写的选项字母，未找到时返回None
+    """
+    for match in _OPTION.finditer(text):
+        group = 'letter' if match.group('letter') else 'lead'
+        if complete or match.end(group) < len(text):
+            return match.group(group).upper()
+    return None
+
+
+def parse_clause(text, poem_chars, complete=True):
+    """
+    在回答中查找由候选字组成的诗句：取每段汉字中最长的、完全由候选字组成的连续子串
+    （每个字的使用次数不超过候选字中的次数），“这句诗是应怜屐齿印苍苔”中也能找到诗句
+    :param poem_chars: 题目给出的候选字
+    :param complete: 回答是否已经结束；未结束时诗句之后必须已有其他字符
+    :return: 诗句，未找到时返回None
+    """
+    available = Counter(poem_chars)
+    min_chars = min(MIN_CLAUSE_CHARS, len(poem_chars))
+    for match in _HAN_RUN.finditer(text):
+        if not complete and match.end() == len(text):
+            break
+        clause = _longest_candidate_span(match.group(), available)
+        if len(clause) >= min_chars:
+            return clause
+    return None
+
+
+def _longest_candidate_span(run, available):
+    """滑动窗口求 run 中最长的、各字使用次数都不超过 available 的连续子串"""
+    used = Counter()
+    start = 0
+    best = (0, 0)
+    for end, char in enumerate(run):
+        if char not in available:
+            used.clear()
+            start = end + 1
+            continue
+        used[char] += 1
+        while used[char] > available[char]:
+            used[run[start]] -= 1
+            start += 1
+        if end + 1 - start > best[1] - best[0]:
+            best = (start, end + 1)
+    return run[best[0]:best[1]]
+
+
+def parse_answer(text, poem_chars=None, complete=True):
+    """
+    解析回答中的明确答案：诗词组字题为诗句，其他题目为选项字母
+    :param poem_chars: 诗词组字题的候选字，其他题目为None
+    :return: 答案字符串，尚无明确答案时返回None
+    """
+    if not text:
+        return None
+    if poem_chars:
+        return parse_clause(text, poem_chars, complete)
+    return parse_option(text, complete)
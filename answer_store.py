@@ -0,0 +1,201 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+
+
+class AnswerStore:
+    """
+    跨会话的组字题答案库（SQLite旁路文件）
+    保存 字符集键 -> 命中的 (诗词行ID或下标, 诗句) 列表，重启后在索引构建前即可直接作答；
+    超出容量时按最近使用时间淘汰；答案对应的数据库状态记录在 state 中，
+    数据库变化后由调用方按变更记录淘汰受影响的答案（evict），无法确定变化时整体清空（clear）；
+    新答案先缓冲在内存中，攒够一批或间隔足够久时再写入，避免每次查询都提交一次事务
+    """
+
+    # 旁路库格式版本号，表结构变化时递增
+    FORMAT_VERSION = 1
+
+    def __init__(self, path, key, max_entries=5000, flush_size=64, flush_interval=30.0):
+        """
+        :param path: 旁路文件路径
+        :param key: 校验键（索引配置等），与已保存的不一致时清空答案
+        :param max_entries: 最多保存的答案数量
+        :param flush_size: 缓冲的答案达到该数量时写入磁盘
+        :param flush_interval: 距上次写入超过该秒数时，下一次保存会顺带写入磁盘
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        # {key: (payload_json, last_used)}，尚未写入磁盘的答案
+        self._pending = {}
+        self._last_flush = time.monotonic()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS answers ("
+            "key TEXT PRIMARY KEY, payload TEXT NOT NULL, hits INTEGER NOT NULL DEFAULT 0, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS answers_last_used ON answers (last_used)")
+
+        full_key = json.dumps({'format': self.FORMAT_VERSION, **key}, ensure_ascii=False, sort_keys=True)
+        row = self._conn.execute("SELECT value FROM meta WHERE key = 'key'").fetchone()
+        if row is None or row[0] != full_key:
+            if row is not None:
+                logging.info("索引配置已变化，清空已保存的答案")
+            self._conn.execute("DELETE FROM answers")
+            self._conn.execute("DELETE FROM meta WHERE key = 'state'")
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('key', ?)", (full_key,))
+        self._conn.commit()
+
+    @property
+    def state(self):
+        """已保存的答案对应的数据库状态（可JSON序列化），未记录时为None"""
+        with self._lock:
+            if self._conn is None:
+                return None
+            row = self._conn.execute("SELECT value FROM meta WHERE key = 'state'").fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set_state(self, state):
+        """记录已保存的答案对应的数据库状态"""
+        with self._lock:
+            if self._conn is None:
+                return
+            self._conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('state', ?)", (json.dumps(state, ensure_ascii=False),)
+            )
+            self._conn.commit()
+
+    def evict(self, predicate):
+        """
+        删除满足条件的答案
+        :param predicate: predicate(key, [(poem_ref, [clause, ...]), ...])，返回True的答案被删除
+        :return: 删除的数量
+        """
+        with self._lock:
+            if self._conn is None:
+                return 0
+            self._flush()
+            stale = [
+                (key,) for key, payload in self._conn.execute("SELECT key, payload FROM answers")
+                if predicate(key, json.loads(payload))
+            ]
+            self._conn.executemany("DELETE FROM answers WHERE key = ?", stale)
+            self._conn.commit()
+        return len(stale)
+
+    def clear(self):
+        """清空全部答案"""
+        with self._lock:
+            if self._conn is None:
+                return
+            self._pending.clear()
+            self._conn.execute("DELETE FROM answers")
+            self._conn.commit()
+
+    def get(self, key):
+        """
+        查找答案并刷新最近使用时间
+        :return: [(poem_ref, [clause, ...]), ...]，不存在时返回None
+        """
+        with self._lock:
+            if self._conn is None:
+                return None
+            pending = self._pending.get(key)
+            if pending is not None:
+                return [(poem_ref, clauses) for poem_ref, clauses in json.loads(pending[0])]
+            row = self._conn.execute("SELECT payload FROM answers WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE answers SET hits = hits + 1, last_used = ? WHERE key = ?", (time.time(), key)
+            )
+            self._conn.commit()
+        return [(poem_ref, clauses) for poem_ref, clauses in json.loads(row[0])]
+
+    def put_many(self, entries):
+        """
+        保存答案
+        :param entries: [(key, [(poem_ref, [clause, ...]), ...]), ...]
+        """
+        if not entries:
+            return
+        now = time.time()
+        with self._lock:
+            if self._conn is None:
+                return
+            for key, payload in entries:
+                self._pending[key] = (json.dumps(payload, ensure_ascii=False), now)
+            if (len(self._pending) >= self.flush_size
+                    or time.monotonic() - self._last_flush >= self.flush_interval):
+                self._flush()
+
+    def flush(self):
+        """将缓冲的答案写入磁盘"""
+        with self._lock:
+            if self._conn is not None:
+                self._flush()
+
+    def _flush(self):
+        self._last_flush = time.monotonic()
+        if not self._pending:
+            return
+        rows = [(key, payload, last_used) for key, (payload, last_used) in self._pending.items()]
+        self._pending.clear()
+        self._conn.executemany(
+            "INSERT INTO answers (key, payload, last_used) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET payload = excluded.payload, last_used = excluded.last_used",
+            rows,
+        )
+        self._evict()
+        self._conn.commit()
+
+    def _evict(self):
+        """淘汰最久未使用的答案，使数量不超过上限"""
+        count = self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+        excess = count - self.max_entries
+        if excess > 0:
+            self._conn.execute(
+                "DELETE FROM answers WHERE key IN (SELECT key FROM answers ORDER BY last_used LIMIT ?)",
+                (excess,),
+            )
+
+    def __len__(self):
+        with self._lock:
+            if self._conn is None:
+                return 0
+            self._flush()
+            return self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                try:
+                    self._flush()
+                except sqlite3.Error as e:
+                    logging.warning(f"写入答案库失败: {e}")
+                self._conn.close()
+                self._conn = None
+
+    @classmethod
+    def open(cls, path, key, max_entries=5000):
+        """打开答案库，文件损坏时删除重建，仍失败则返回None"""
+        for attempt in range(2):
+            try:
+                return cls(path, key, max_entries)
+            except sqlite3.DatabaseError as e:
+                logging.warning(f"答案库不可用: {e}")
+                if attempt == 0 and os.path.exists(path):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        return None
+            except Exception as e:
+                logging.warning(f"打开答案库失败: {e}")
+                return None
+        return None
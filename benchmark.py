@@ -0,0 +1,485 @@
+"""
+本地诗词匹配基准测试
+
+用法：
+    python benchmark.py generate --size 100000 --output bench/poetry.db
+    python benchmark.py run --db bench/poetry.db --output result.json
+    python benchmark.py run --size 100000 --output result.json   # 自动生成临时数据库
+    python benchmark.py compare baseline.json result.json --threshold 0.2
+    python benchmark.py parse --corpus question_corpus.json            # 题目解析准确率与吞吐量
+    python benchmark.py refresh --size 20000                           # 删除诗词后检查搜索结果
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import sqlite3
+import logging
+import argparse
+import platform
+import tempfile
+import statistics
+
+from knowledge_base_manager import KnowledgeBaseManager
+from question_parser import extract_poem_chars, format_question_text
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# 题目中常见的OCR干扰字（按钮文字、分数等）
+_NOISE_CHARS = '确定取消提交重置分题第一二三四五六七八九十'
+# 旁路文件后缀，生成数据库时需要删除
+_SIDECAR_SUFFIXES = ('.idx', '.idx.delta', '.fts', '.answers')
+
+
+def _char_pool(pool_size, rng):
+    """生成带Zipf分布权重的常用汉字池，使字频接近真实诗词"""
+    chars = [chr(0x4E00 + i) for i in rng.sample(range(0x5000), pool_size)]
+    weights = [1.0 / (rank + 1) ** 0.9 for rank in range(pool_size)]
+    return chars, weights
+
+
+def generate_db(path, size, seed=42, pool_size=5000):
+    """
+    生成与 poetry.db 相同 poems 表结构的合成数据库
+    :param path: 输出路径（已存在时覆盖）
+    :param size: 诗词数量
+    """
+    rng = random.Random(seed)
+    chars, weights = _char_pool(pool_size, rng)
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    for suffix in ('',) + _SIDECAR_SUFFIXES:
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute(
+            "CREATE TABLE poems (id INTEGER PRIMARY KEY, title TEXT, author TEXT, paragraphs TEXT)"
+        )
+        batch = []
+        for i in range(size):
+            clause_len = rng.choice((5, 5, 7, 7, 7, 4, 6))
+            lines = []
+            for _ in range(rng.randint(1, 4)):
+                first = ''.join(rng.choices(chars, weights, k=clause_len))
+                second = ''.join(rng.choices(chars, weights, k=clause_len))
+                lines.append(f"{first}，{second}。")
+            title = ''.join(rng.choices(chars, weights, k=rng.randint(2, 6)))
+            author = ''.join(rng.choices(chars, weights, k=rng.randint(2, 3)))
+            batch.append((title, author, json.dumps(lines, ensure_ascii=False)))
+            if len(batch) >= 10000:
+                conn.executemany("INSERT INTO poems (title, author, paragraphs) VALUES (?, ?, ?)", batch)
+                batch = []
+        if batch:
+            conn.executemany("INSERT INTO poems (title, author, paragraphs) VALUES (?, ?, ?)", batch)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def build_questions(kb, count, seed=7):
+    """
+    从已构建的索引中抽取诗句，生成带干扰字的题目
+    :return: {题型: [(题目字符串, 出题所用的诗句), ...]}，无解题的诗句为None
+    """
+    rng = random.Random(seed)
+    table = kb._index.table
+    sampled = [table.clause(rng.randrange(len(table))) for _ in range(count)]
+
+    def shuffled(text):
+        chars = list(text)
+        rng.shuffle(chars)
+        return ''.join(chars)
+
+    other_chars = [table.clause(rng.randrange(len(table))) for _ in range(count)]
+
+    # 把诗句中的一个字换成形近字，模拟OCR误识别（只从含有形近字的诗句中抽取）
+    confusion = kb._confusion
+    confusable = []
+    for _ in range(count * 100):
+        if len(confusable) >= count:
+            break
+        clause = table.clause(rng.randrange(len(table)))
+        positions = [pos for pos, char in enumerate(clause) if char in confusion]
+        if not positions:
+            continue
+        pos = rng.choice(positions)
+        partner = rng.choice(sorted(confusion[clause[pos]] - {clause[pos]}))
+        misread = clause[:pos] + partner + clause[pos + 1:]
+        confusable.append((shuffled(misread + ''.join(rng.sample(_NOISE_CHARS, 2))), clause))
+
+    # 从不同诗句中各取一个字拼成题目，只保留组不成任何诗句（含容错匹配）的，走完精确与容错两轮扫描
+    missing = []
+    for _ in range(count * 20):
+        if len(missing) >= count:
+            break
+        question = ''.join(
+            rng.choice(table.clause(rng.randrange(len(table)))) for _ in range(rng.randint(8, 12))
+        )
+        kb._poem_cache.clear()
+        if not kb.find_poem_from_chars(question):
+            missing.append((question, None))
+    kb._poem_cache.clear()
+
+    return {
+        # 题目给出的字恰好组成一句
+        'exact': [(shuffled(clause), clause) for clause in sampled],
+        # 混入其他诗句的字和OCR噪声
+        'distractor': [
+            (shuffled(clause + other[:rng.randint(2, 5)] + ''.join(rng.sample(_NOISE_CHARS, 2))), clause)
+            for clause, other in zip(sampled, other_chars)
+        ],
+        # 噪声字 + 一句诗句
+        'noisy_hit': [(shuffled(''.join(rng.sample(_NOISE_CHARS, 6)) + other), other) for other in other_chars],
+        # 组不成任何诗句，应返回None
+        'miss': missing,
+        # 一个字被误识别为形近字，需要容错匹配
+        'confusable': confusable,
+    }
+
+
+def _percentile(samples, pct):
+    ordered = sorted(samples)
+    if not ordered:
+        return None
+    pos = min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))
+    return ordered[pos]
+
+
+def _latency_stats(samples_ms):
+    return {
+        'count': len(samples_ms),
+        'p50_ms': _percentile(samples_ms, 50),
+        'p99_ms': _percentile(samples_ms, 99),
+        'mean_ms': statistics.fmean(samples_ms) if samples_ms else None,
+        'max_ms': max(samples_ms) if samples_ms else None,
+    }
+
+
+def _peak_rss_mb():
+    """进程峰值常驻内存（MB），不支持的平台返回None"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS 以字节为单位，Linux 以KB为单位
+    return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+
+
+def _time_queries(func, queries):
+    samples = []
+    for query in queries:
+        start = time.perf_counter()
+        func(query)
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def run_benchmark(db_path, queries_per_kind=500, search_queries=200, build_workers=None):
+    """
+    将数据库复制到临时目录后依次测量加载、冷/热索引构建、组字查询和全文搜索；
+    原数据库及其旁路文件（预构建索引、答案库）不会被修改
+    :return: 结果字典
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        copy_path = os.path.join(tmp_dir, os.path.basename(db_path))
+        shutil.copyfile(db_path, copy_path)
+        results = _run_benchmark(copy_path, queries_per_kind, search_queries, build_workers)
+    return {'db': os.path.abspath(db_path), **results}
+
+
+def _run_benchmark(db_path, queries_per_kind, search_queries, build_workers):
+    results = {
+        'db_size_mb': os.path.getsize(db_path) / 1024 / 1024,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+    start = time.perf_counter()
+    # 不启用答案库：测量的是索引查找本身，答案库的批量写入会干扰尾延迟
+    kb = KnowledgeBaseManager(db_path=db_path, build_workers=build_workers, answer_store_size=0)
+    kb.ensure_loaded()
+    results['load_s'] = time.perf_counter() - start
+    results['poem_count'] = len(kb.poetry_data)
+
+    start = time.perf_counter()
+    kb.ensure_index()
+    results['index_build_cold_s'] = time.perf_counter() - start
+    results['clause_count'] = len(kb._index)
+    results['index_bytes'] = kb._index.nbytes()
+
+    # 热启动：新实例从旁路缓存加载索引
+    warm = KnowledgeBaseManager(db_path=db_path, build_workers=build_workers, answer_store_size=0)
+    start = time.perf_counter()
+    warm.ensure_index()
+    results['index_load_warm_s'] = time.perf_counter() - start
+    warm.release()
+
+    questions = build_questions(kb, queries_per_kind)
+    query_results = {}
+    for kind, pairs in questions.items():
+        expected = dict(pairs)
+        found = 0
+        top1 = 0
+
+        def _query(chars):
+            nonlocal found, top1
+            # 每次查询前清空结果缓存，测量真实的索引查找耗时
+            kb._poem_cache.clear()
+            answer = kb.find_poem_from_chars(chars)
+            if answer:
+                found += 1
+                # 排在第一位的诗句就是出题所用的诗句
+                if answer[0][1][0] == expected[chars]:
+                    top1 += 1
+
+        samples = _time_queries(_query, [question for question, _ in pairs])
+        query_results[kind] = {**_latency_stats(samples), 'found': found, 'top1': top1}
+    results['find_poem_from_chars'] = query_results
+
+    rng = random.Random(11)
+    table = kb._index.table
+    search_terms = []
+    for _ in range(search_queries):
+        clause = table.clause(rng.randrange(len(table)))
+        start_pos = rng.randrange(len(clause) - 1)
+        search_terms.append(clause[start_pos:start_pos + rng.randint(2, 3)])
+
+    results['search_linear'] = _latency_stats(
+        _time_queries(lambda q: kb.search(q, limit=10), search_terms[:max(1, search_queries // 10)])
+    )
+
+    start = time.perf_counter()
+    kb.ensure_search_index()
+    results['search_index_build_s'] = time.perf_counter() - start
+    results['search_indexed'] = _latency_stats(
+        _time_queries(lambda q: kb.search(q, limit=10), search_terms)
+    )
+
+    results['peak_rss_mb'] = _peak_rss_mb()
+    kb.release()
+    return results
+
+
+def run_parse_benchmark(corpus_path, rounds=1000):
+    """
+    用标注的OCR识别结果测量题目解析：是否识别为组字题、提取的候选字是否与标注一致，以及单题耗时与吞吐量
+    :param corpus_path: 标注语料JSON：[{"text": OCR文本, "poem_task": 是否组字题, "chars": 候选字}, ...]
+    :return: 结果字典
+    """
+    with open(corpus_path, encoding='utf-8') as f:
+        corpus = json.load(f)
+
+    def parse(text):
+        return extract_poem_chars(format_question_text(text))
+
+    failures = []
+    task_correct = 0
+    chars_correct = 0
+    for case in corpus:
+        chars = parse(case['text'])
+        if (chars is not None) == case['poem_task']:
+            task_correct += 1
+            if not case['poem_task'] or chars == case['chars']:
+                chars_correct += 1
+                continue
+        failures.append({'text': case['text'], 'expected': case['chars'], 'actual': chars})
+
+    texts = [case['text'] for case in corpus]
+    samples = []
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for text in texts:
+            began = time.perf_counter()
+            parse(text)
+            samples.append((time.perf_counter() - began) * 1000)
+    elapsed = time.perf_counter() - start
+
+    return {
+        'corpus': os.path.abspath(corpus_path),
+        'cases': len(corpus),
+        'task_accuracy': task_correct / len(corpus) if corpus else None,
+        'chars_accuracy': chars_correct / len(corpus) if corpus else None,
+        'failures': failures,
+        'latency': _latency_stats(samples),
+        'questions_per_s': len(samples) / elapsed if elapsed else None,
+    }
+
+
+def check_refresh(db_path, delta_deletes=40, rebuild_fraction=0.2, seed=5):
+    """
+    在数据库副本上删除诗词并调用 refresh_index，检查全文搜索不再返回已删除的诗词、
+    不返回空诗词占位，且仍能找到未删除的诗词；依次覆盖增量更新和全量重建两种路径
+    :return: 失败描述列表，为空表示通过
+    """
+    failures = []
+    rng = random.Random(seed)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        copy_path = os.path.join(tmp_dir, os.path.basename(db_path))
+        shutil.copyfile(db_path, copy_path)
+        kb = KnowledgeBaseManager(db_path=copy_path, build_workers=1, answer_store_size=0)
+        try:
+            kb.ensure_index()
+            kb.ensure_search_index()
+            for stage, fraction in (('delta', None), ('rebuild', rebuild_fraction)):
+                conn = sqlite3.connect(copy_path)
+                try:
+                    rows = conn.execute("SELECT id, title, author FROM poems").fetchall()
+                    count = delta_deletes if fraction is None else int(len(rows) * fraction)
+                    deleted = rng.sample(rows, count)
+                    with conn:
+                        conn.executemany("DELETE FROM poems WHERE id = ?", [(row[0],) for row in deleted])
+                    remaining = {(title, author) for _, title, author in
+                                 conn.execute("SELECT id, title, author FROM poems")}
+                finally:
+                    conn.close()
+                kb.refresh_index()
+
+                for _, title, author in deleted[:20]:
+                    for poem in kb.search(title, limit=20):
+                        pair = (poem.get('title'), poem.get('author'))
+                        if pair not in remaining:
+                            failures.append(f"{stage}: 搜索 {title} 返回了已删除或错位的诗词 {pair}")
+                for title, author in rng.sample(sorted(remaining), 20):
+                    if (title, author) not in {(p.get('title'), p.get('author')) for p in kb.search(title, limit=50)}:
+                        failures.append(f"{stage}: 搜索 {title} 未找到未删除的诗词")
+        finally:
+            kb.release()
+    return failures
+
+
+# compare 时参与回归判断的指标（越小越好）
+_COMPARED_METRICS = (
+    ('load_s',),
+    ('index_build_cold_s',),
+    ('index_load_warm_s',),
+    ('peak_rss_mb',),
+    ('find_poem_from_chars', 'exact', 'p50_ms'),
+    ('find_poem_from_chars', 'exact', 'p99_ms'),
+    ('find_poem_from_chars', 'distractor', 'p50_ms'),
+    ('find_poem_from_chars', 'distractor', 'p99_ms'),
+    ('find_poem_from_chars', 'noisy_hit', 'p99_ms'),
+    ('find_poem_from_chars', 'miss', 'p50_ms'),
+    ('find_poem_from_chars', 'miss', 'p99_ms'),
+    ('find_poem_from_chars', 'confusable', 'p50_ms'),
+    ('find_poem_from_chars', 'confusable', 'p99_ms'),
+    ('search_indexed', 'p50_ms'),
+    ('search_indexed', 'p99_ms'),
+)
+
+
+def _lookup(data, path):
+    for key in path:
+        if not isinstance(data, dict) or key not in data:
+            return None
+        data = data[key]
+    return data
+
+
+def compare_results(baseline, current, threshold):
+    """
+    对比两次结果
+    :return: (报告行列表, 是否存在回归)
+    """
+    lines = []
+    regressed = False
+    for path in _COMPARED_METRICS:
+        old = _lookup(baseline, path)
+        new = _lookup(current, path)
+        name = '.'.join(path)
+        if old is None or new is None:
+            lines.append(f"{name:45s} {'-':>12s} {'-':>12s}")
+            continue
+        change = (new - old) / old if old else 0.0
+        flag = ''
+        if change > threshold:
+            flag = '  <-- 回归'
+            regressed = True
+        lines.append(f"{name:45s} {old:12.4f} {new:12.4f} {change:+8.1%}{flag}")
+    return lines, regressed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="本地诗词匹配基准测试")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    gen = subparsers.add_parser('generate', help="生成合成 poetry.db")
+    gen.add_argument('--size', type=int, default=100000, help="诗词数量（10k-1M）")
+    gen.add_argument('--output', required=True, help="输出数据库路径")
+    gen.add_argument('--seed', type=int, default=42)
+
+    run = subparsers.add_parser('run', help="运行基准测试")
+    run.add_argument('--db', help="数据库路径（不指定时按 --size 生成临时库）")
+    run.add_argument('--size', type=int, default=100000, help="自动生成数据库时的诗词数量")
+    run.add_argument('--queries', type=int, default=500, help="每种题型的查询数量")
+    run.add_argument('--workers', type=int, default=None, help="构建索引的进程数")
+    run.add_argument('--output', help="结果JSON输出路径（默认输出到标准输出）")
+
+    parse_parser = subparsers.add_parser('parse', help="测试题目解析的准确率与吞吐量")
+    parse_parser.add_argument('--corpus', default='question_corpus.json', help="标注的OCR识别结果")
+    parse_parser.add_argument('--rounds', type=int, default=1000, help="吞吐量测试时语料重复的轮数")
+    parse_parser.add_argument('--output', help="结果JSON输出路径（默认输出到标准输出）")
+
+    refresh_parser = subparsers.add_parser('refresh', help="删除诗词后检查增量更新与全量重建后的搜索结果")
+    refresh_parser.add_argument('--db', help="数据库路径（在副本上测试；不指定时按 --size 生成临时库）")
+    refresh_parser.add_argument('--size', type=int, default=20000, help="自动生成数据库时的诗词数量")
+
+    cmp_parser = subparsers.add_parser('compare', help="对比两次结果")
+    cmp_parser.add_argument('baseline')
+    cmp_parser.add_argument('current')
+    cmp_parser.add_argument('--threshold', type=float, default=0.2, help="允许的相对退化比例")
+
+    args = parser.parse_args(argv)
+    logging.getLogger().setLevel(logging.WARNING)
+
+    if args.command == 'generate':
+        start = time.perf_counter()
+        generate_db(args.output, args.size, seed=args.seed)
+        print(f"已生成 {args.size} 首诗词: {args.output}（{time.perf_counter() - start:.1f} 秒）")
+        return 0
+
+    if args.command == 'refresh':
+        if args.db:
+            failures = check_refresh(args.db)
+        else:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                db_path = os.path.join(tmp_dir, 'poetry.db')
+                generate_db(db_path, args.size)
+                failures = check_refresh(db_path)
+        print('\n'.join(failures) if failures else "刷新索引后搜索结果正确")
+        return 1 if failures else 0
+
+    if args.command in ('run', 'parse'):
+        if args.command == 'parse':
+            results = run_parse_benchmark(args.corpus, args.rounds)
+        elif args.db:
+            results = run_benchmark(args.db, args.queries, build_workers=args.workers)
+        else:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                db_path = os.path.join(tmp_dir, 'poetry.db')
+                generate_db(db_path, args.size)
+                results = run_benchmark(db_path, args.queries, build_workers=args.workers)
+        output = json.dumps(results, ensure_ascii=False, indent=2)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                f.write(output)
+        print(output)
+        return 0
+
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+    with open(args.current, encoding='utf-8') as f:
+        current = json.load(f)
+    lines, regressed = compare_results(baseline, current, args.threshold)
+    print('\n'.join(lines))
+    return 1 if regressed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,110 @@
+"""
+离线构建诗词索引：加载 poetry.db，生成可内存映射的诗句索引（poetry.db.idx）和全文检索索引（poetry.db.fts），
+发布时随数据库一起分发即可免去用户首次启动的构建；
+索引配置（诗句长度、相邻两句签名）与程序默认值一致，否则程序启动时会判定索引失效并重新构建
+
+用法：
+    python build_index.py
+    python build_index.py --db path/to/poetry.db --workers 4
+    python build_index.py --no-fts
+"""
+import os
+import sys
+import time
+import argparse
+
+from knowledge_base_manager import KnowledgeBaseManager
+
+
+def _mb(size):
+    return f"{size / 1024 / 1024:.1f}MB"
+
+
+def build_all(db_path, workers=None, fts=True):
+    """
+    构建所有索引并写入磁盘
+    :return: 报告字典（耗时单位为秒、大小单位为字节），数据库无法加载时返回None
+    """
+    report = {'db': db_path, 'db_size': os.path.getsize(db_path)}
+
+    start = time.perf_counter()
+    kb = KnowledgeBaseManager(db_path=db_path, build_workers=workers, answer_store_size=0)
+    if not kb.is_loaded or kb._data_source != 'sqlite':
+        return None
+    report['load_s'] = time.perf_counter() - start
+    report['poem_count'] = len(kb.poetry_data)
+
+    try:
+        start = time.perf_counter()
+        kb._build_index(use_cache=False)
+        report['index_build_s'] = time.perf_counter() - start
+        index = kb._index
+        index_path = kb._index_cache_path()
+        report['index_path'] = index_path
+        report['index_size'] = os.path.getsize(index_path) if os.path.exists(index_path) else None
+        report['clause_count'] = len(index)
+        report['char_count'] = len(index.postings)
+        report['couplet_count'] = len(index.pair_sig_hashes)
+        report['index_sections'] = index.nbytes()
+        report['length_stats'] = index.length_stats
+
+        if fts:
+            start = time.perf_counter()
+            kb.ensure_search_index(rebuild=True)
+            report['fts_build_s'] = time.perf_counter() - start
+            fts_path = kb._search_index_path()
+            report['fts_path'] = fts_path
+            report['fts_size'] = os.path.getsize(fts_path) if kb._search_ready else None
+    finally:
+        kb.release()
+    return report
+
+
+def print_report(report):
+    print(f"数据库: {report['db']}（{_mb(report['db_size'])}，{report['poem_count']} 首）")
+    print(f"加载: {report['load_s']:.2f} 秒")
+
+    if report['index_size'] is None:
+        print("诗句索引: 写入失败，详见日志")
+    else:
+        sections = '，'.join(f"{name} {_mb(size)}" for name, size in report['index_sections'].items())
+        print(f"诗句索引: {report['index_path']}（{_mb(report['index_size'])}：{sections}）")
+    print(f"    {report['clause_count']} 个诗句，{report['char_count']} 个字符，"
+          f"{report['couplet_count']} 组相邻两句，耗时 {report['index_build_s']:.2f} 秒")
+    for length, (clause_count, posting_count) in report['length_stats'].items():
+        print(f"    {length}字: {clause_count} 句，倒排 {posting_count} 条")
+
+    if 'fts_build_s' in report:
+        if report['fts_size'] is None:
+            print("全文检索索引: 构建失败，详见日志")
+        else:
+            print(f"全文检索索引: {report['fts_path']}（{_mb(report['fts_size'])}），"
+                  f"耗时 {report['fts_build_s']:.2f} 秒")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="离线构建诗词索引")
+    parser.add_argument('--db', default='poetry.db', help="诗词数据库路径")
+    parser.add_argument('--workers', type=int, default=None, help="构建索引的进程数（默认按CPU核数）")
+    parser.add_argument('--no-fts', action='store_true', help="不构建全文检索索引")
+    args = parser.parse_args(argv)
+
+    db_path = os.path.abspath(args.db)
+    if not os.path.exists(db_path):
+        print(f"数据库不存在: {db_path}")
+        return 1
+
+    start = time.perf_counter()
+    report = build_all(db_path, workers=args.workers, fts=not args.no_fts)
+    if report is None:
+        print(f"无法加载数据库: {db_path}")
+        return 1
+
+    print_report(report)
+    print(f"总耗时 {time.perf_counter() - start:.1f} 秒")
+    failed = report['index_size'] is None or report.get('fts_size', 0) is None
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
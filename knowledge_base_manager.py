@@ -1,8 +1,22 @@
 import os
+import re
 import sys
+import time
+import hashlib
 import sqlite3
 import json
 import logging
+import threading
+from array import array
+from bisect import bisect_left
+from itertools import islice
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from poem_index import ClauseIndex, ClauseIndexBuilder, chars_mask, merge_parts
+from poem_search import PoemSearchIndex
+from poem_index_file import MappedClauseTable, load_index_file, write_index_file
+from answer_store import AnswerStore
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -26,8 +40,574 @@ def get_resource_path(relative_path):
     # 开发环境
     return os.path.join(os.path.abspath("."), relative_path)
 
+def _detect_poem_table(cursor):
+    """
+    查找存放诗词的数据表
+    :return: (表名, 列名列表)，未找到时返回None
+    """
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
+    tables = cursor.fetchall()
+
+    if not tables:
+        logging.warning("SQLite数据库中没有找到表")
+        return None
+
+    # 优先尝试poems表
+    table_name = 'poems'
+    try:
+        cursor.execute(f"SELECT COUNT(*) FROM {table_name}")
+        count = cursor.fetchone()[0]
+        if count == 0:
+            raise Exception("poems表为空")
+    except:
+        # 如果poems表不存在或为空，尝试其他表
+        for table_tuple in tables:
+            table_name = table_tuple[0]
+            if 'poems' in table_name.lower():
+                try:
+                    cursor.execute(f"SELECT COUNT(*) FROM {table_name}")
+                    count = cursor.fetchone()[0]
+                    if count > 0:
+                        break
+                except:
+                    continue
+        else:
+            logging.warning("未找到包含数据的表")
+            return None
+
+    cursor.execute(f"PRAGMA table_info({table_name})")
+    column_names = [col[1] for col in cursor.fetchall()]
+    return table_name, column_names
+
+
+def _poem_select_columns(column_names):
+    """根据表结构确定需要查询的列，无法识别时返回None"""
+    if 'content' in column_names:
+        return 'content'
+    if 'title' in column_names and 'author' in column_names:
+        if 'paragraphs' in column_names:
+            return 'title, author, paragraphs'
+        return 'title, author'
+    return None
+
+
+def _row_to_poem(row, column_names):
+    """
+    将一行查询结果转换为诗词字典
+    :param row: 按 _poem_select_columns 的列顺序排列的行
+    :return: 诗词字典，解析失败时返回None
+    """
+    try:
+        if 'content' in column_names:
+            return json.loads(row[0])
+
+        title = row[0] or '无题'
+        author = row[1] or '佚名'
+
+        # 处理内容
+        if len(row) > 2 and row[2]:
+            try:
+                paragraphs = json.loads(row[2]) if isinstance(row[2], str) else row[2]
+                content = paragraphs if isinstance(paragraphs, list) else [str(paragraphs)]
+            except:
+                content = [str(row[2])]
+        else:
+            content = []
+
+        return {
+            'title': title,
+            'author': author,
+            'content': content
+        }
+    except Exception:
+        return None
+
+
+def _iter_sqlite_poems(db_path, table_name, column_names, first_rowid=None, last_rowid=None,
+                       batch_size=2000):
+    """
+    按行ID顺序流式读取诗词（使用独立连接）
+    :param first_rowid: 起始行ID（含），None表示从头开始
+    :param last_rowid: 结束行ID（含），None表示读到末尾
+    :return: 诗词字典迭代器，解析失败的行返回None
+    """
+    select_columns = _poem_select_columns(column_names)
+    sql = f"SELECT {select_columns} FROM {table_name}"
+    params = ()
+    if first_rowid is not None and last_rowid is not None:
+        sql += " WHERE rowid BETWEEN ? AND ?"
+        params = (first_rowid, last_rowid)
+    sql += " ORDER BY rowid"
+
+    conn = sqlite3.connect(db_path)
+    try:
+        cursor = conn.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                yield _row_to_poem(row, column_names)
+    finally:
+        conn.close()
+
+
+# 诗句分隔符
+_CLAUSE_SPLIT_PATTERN = re.compile(r'[，。？！,?!；;]')
+
+
+def make_char_table(char_map):
+    """
+    将 {字: 字} 映射表编译为 str.translate 使用的转换表
+    只允许一对一替换且不涉及分隔符和空白，归一化后文本长度和分句位置不变
+    :raises ValueError: 映射表包含不符合要求的项
+    """
+    for source, target in char_map.items():
+        for char in (source, target):
+            if len(char) != 1 or char.isspace() or _CLAUSE_SPLIT_PATTERN.match(char):
+                raise ValueError(f"字符映射只能是单个非分隔字符: {source!r} -> {target!r}")
+    return str.maketrans(char_map)
+
+
+def normalize_text(text, char_table):
+    """按转换表逐字归一化文本（不改变长度）"""
+    return text.translate(char_table)
+
+
+def make_confusion_classes(groups, char_table):
+    """
+    将形近字组编译为 {字: 所属形近字类}，有公共字的组合并为同一类
+    :param groups: 形近字组序列，每组为一个字符串
+    :param char_table: 归一化转换表，形近字按归一化后的字比较
+    :return: {字: frozenset(同类的字)}，同一类的字共享同一个集合对象
+    """
+    classes = {}
+    for group in groups:
+        members = set(normalize_text(group, char_table))
+        for char in list(members):
+            members |= classes.get(char, frozenset())
+        if len(members) < 2:
+            continue
+        merged = frozenset(members)
+        for char in merged:
+            classes[char] = merged
+    return classes
+
+
+def _index_poems(indexed_poems, char_table, builder, clause_lengths):
+    """
+    将 (poem_idx, poem) 序列切分为诗句并追加到索引构建器
+    :param char_table: make_char_table 生成的归一化转换表
+    :param clause_lengths: 需要索引的诗句长度集合
+    """
+    for poem_idx, poem in indexed_poems:
+        if not poem:
+            continue
+        content = poem.get('content', [])
+        if isinstance(content, str):
+            content = [content]
+
+        for line in content:
+            # 整行归一化一次；转换不涉及分隔符和空白，原文与归一化文本按相同位置切分
+            clauses = _CLAUSE_SPLIT_PATTERN.split(line)
+            normalized_line = line.translate(char_table)
+            if normalized_line == line:
+                normalized_clauses = clauses
+            else:
+                normalized_clauses = _CLAUSE_SPLIT_PATTERN.split(normalized_line)
+            # 上一句是否已索引，用于记录同一行中相邻的两句
+            previous_indexed = False
+
+            for clause, normalized_clause in zip(clauses, normalized_clauses):
+                clause = clause.strip()
+                if not clause:
+                    continue
+
+                # 只索引指定长度的诗句
+                if len(clause) not in clause_lengths:
+                    previous_indexed = False
+                    continue
+
+                normalized_clause = clause if normalized_clauses is clauses else normalized_clause.strip()
+                builder.add(poem_idx, clause, normalized_clause, joins_previous=previous_indexed)
+                previous_indexed = True
+
+
+def _build_index_shard(db_path, table_name, column_names, first_rowid, last_rowid, start_idx, char_table,
+                       clause_lengths, pair_signatures):
+    """子进程入口：从数据库读取一个行ID区间的诗词并构建分片索引"""
+    builder = ClauseIndexBuilder(pair_signatures)
+    poems = _iter_sqlite_poems(db_path, table_name, column_names, first_rowid, last_rowid)
+    _index_poems(enumerate(poems, start_idx), char_table, builder, clause_lengths)
+    return builder.parts()
+
+
+class _ClauseQuery:
+    """一次组字查询：归一化后的题目字符及预先计算的匹配数据"""
+
+    def __init__(self, clean_chars, confusion=None, max_substitutions=0):
+        """
+        :param confusion: make_confusion_classes 生成的形近字类
+        :param max_substitutions: 容错查询允许诗句中有几个字由题目中的形近字代替，0表示精确查询
+        """
+        self.clean_chars = clean_chars
+        self.key = ''.join(sorted(clean_chars))
+        self.counter = Counter(clean_chars)
+        self.chars_set = set(clean_chars)
+        self.confusion = confusion or {}
+        self.max_substitutions = max_substitutions
+        if max_substitutions:
+            # 容错查询时诗句可以含有题目中某个字的形近字
+            for char in clean_chars:
+                self.chars_set |= self.confusion.get(char, frozenset())
+        # 诗句位掩码中出现题目之外的位，说明诗句含有题目中没有的字
+        self.excluded_bits = ~chars_mask(self.chars_set)
+        # 命中的诗句ID
+        self.candidates = set()
+
+    def substitutions(self, clause_counter):
+        """
+        诗句的字能否由题目的字组成：题目缺少的字可以由题目中多出来的同类形近字代替
+        :param clause_counter: 诗句（或相邻两句）的 Counter
+        :return: 需要代替的字数，不能组成或超过 max_substitutions 时返回None
+        """
+        counter = self.counter
+        # {形近字类: 缺少的字数}
+        shortage = {}
+        missing_total = 0
+        for char, count in clause_counter.items():
+            missing = count - counter[char]
+            if missing <= 0:
+                continue
+            group = self.confusion.get(char)
+            missing_total += missing
+            if group is None or missing_total > self.max_substitutions:
+                return None
+            shortage[group] = shortage.get(group, 0) + missing
+
+        for group, missing in shortage.items():
+            spare = sum(max(0, counter[char] - clause_counter[char]) for char in group)
+            if spare < missing:
+                return None
+        return missing_total
+
+
+class PoemMatches(list):
+    """
+    find_poem_from_chars 的返回结果：[(poem_dict, matched_clauses), ...]
+    partial 为 True 表示结果来自预览索引（全量索引尚未就绪，可能不完整）；
+    fuzzy 为 True 表示精确匹配无结果，结果把题目中的个别字当作OCR误识别的形近字
+    """
+
+    def __init__(self, results=(), partial=False, fuzzy=False):
+        super().__init__(results)
+        self.partial = partial
+        self.fuzzy = fuzzy
+
+
+class LRUCache:
+    """
+    线程安全的LRU缓存：按最近使用淘汰，可选过期时间，并统计命中/未命中/淘汰次数
+    缓存的值可以是None，取值时用 MISSING 判断是否命中
+    """
+
+    MISSING = object()
+
+    def __init__(self, capacity, ttl=None):
+        """
+        :param capacity: 最大条目数
+        :param ttl: 条目有效期（秒），None表示不过期
+        """
+        self.capacity = max(1, int(capacity))
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=MISSING):
+        """取值并标记为最近使用，未命中或已过期时返回 default"""
+        with self._lock:
+            entry = self._data.get(key, self.MISSING)
+            if entry is not self.MISSING:
+                value, stored_at = entry
+                if self.ttl is not None and time.monotonic() - stored_at > self.ttl:
+                    del self._data[key]
+                    self.expirations += 1
+                else:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        """写入条目，超出容量时淘汰最久未使用的条目"""
+        with self._lock:
+            self._data[key] = (value, time.monotonic())
+            self._data.move_to_end(key)
+            while len(self._data) > self.capacity:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """清空条目（保留统计数据）"""
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        """命中统计"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'capacity': self.capacity,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+class LazyPoemStore:
+    """
+    SQLite懒加载诗词存储：内存中只保留紧凑的行ID数组，
+    诗词内容在需要展示时按ID查询，并通过小型LRU缓存复用；
+    增量更新索引后，已删除的行仍保留在行ID数组中占位，保证诗词下标稳定
+    """
+
+    # 解析失败的行用空诗词占位，保证下标与行ID一一对应
+    _EMPTY_POEM = {'title': '无题', 'author': '佚名', 'content': []}
+    # 顺序遍历时每批读取的行数
+    _ITER_BATCH_SIZE = 2000
+
+    def __init__(self, db_path, table_name, column_names, cache_size=256):
+        self.db_path = db_path
+        self.table_name = table_name
+        self.column_names = column_names
+        self.cache_size = cache_size
+        self._select_columns = _poem_select_columns(column_names)
+        if self._select_columns is None:
+            raise ValueError(f"表 {table_name} 缺少可识别的诗词列")
+
+        self._lock = threading.Lock()
+        self._cache = LRUCache(cache_size)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._row_ids = array('q')
+        self.reload_row_ids()
+
+    def __len__(self):
+        return len(self._row_ids)
+
+    def __bool__(self):
+        return len(self._row_ids) > 0
+
+    def __getitem__(self, idx):
+        """按下标获取诗词（带LRU缓存）"""
+        with self._lock:
+            poem = self._cache.get(idx, None)
+            if poem is not None:
+                return poem
+
+            if self._conn is None:
+                raise IndexError("诗词存储已释放")
+
+            row_id = self._row_ids[idx]
+            row = self._conn.execute(
+                f"SELECT {self._select_columns} FROM {self.table_name} WHERE rowid = ?", (row_id,)
+            ).fetchone()
+            poem = (_row_to_poem(row, self.column_names) if row else None) or self._EMPTY_POEM
+
+            self._cache.put(idx, poem)
+            return poem
+
+    def __iter__(self):
+        """按下标顺序流式遍历全部诗词（使用独立连接，不占用查询锁），已删除的行返回空诗词"""
+        row_ids = self._row_ids
+        pos = 0
+        conn = sqlite3.connect(self.db_path)
+        try:
+            cursor = conn.execute(
+                f"SELECT rowid, {self._select_columns} FROM {self.table_name} ORDER BY rowid"
+            )
+            while True:
+                rows = cursor.fetchmany(self._ITER_BATCH_SIZE)
+                if not rows:
+                    break
+                for row in rows:
+                    # 跳过已删除行的占位；不在行ID数组中的行不属于当前索引
+                    while pos < len(row_ids) and row_ids[pos] < row[0]:
+                        yield self._EMPTY_POEM
+                        pos += 1
+                    if pos < len(row_ids) and row_ids[pos] == row[0]:
+                        yield _row_to_poem(row[1:], self.column_names) or self._EMPTY_POEM
+                        pos += 1
+        finally:
+            conn.close()
+        for _ in range(pos, len(row_ids)):
+            yield self._EMPTY_POEM
+
+    def iter_priority(self, limit):
+        """
+        优先遍历高频诗词：有 popular 列时取热门诗词，有 source 列时取古诗文网来源，
+        否则按行ID取前 limit 首（合并库中古诗文网数据排在前面）
+        :return: (下标, 诗词) 迭代器
+        """
+        expression = self._popularity_expression()
+        where = f"{expression} > 0" if expression else None
+
+        conn = sqlite3.connect(self.db_path)
+        try:
+            for condition in ([where] if where else []) + [None]:
+                sql = f"SELECT rowid, {self._select_columns} FROM {self.table_name}"
+                if condition:
+                    sql += f" WHERE {condition}"
+                sql += " ORDER BY rowid LIMIT ?"
+                rows = conn.execute(sql, (limit,)).fetchall()
+                if rows:
+                    break
+        finally:
+            conn.close()
+
+        for row in rows:
+            idx = bisect_left(self._row_ids, row[0])
+            yield idx, _row_to_poem(row[1:], self.column_names)
+
+    def _popularity_expression(self):
+        """诗词流行度的SQL表达式：popular 列的值，或是否来自古诗文网（1/0）；表中没有相关列时返回None"""
+        if 'popular' in self.column_names:
+            return "COALESCE(popular, 0)"
+        if 'source' in self.column_names:
+            return "(source LIKE '%古诗文%' OR source LIKE '%gushiwen%')"
+        return None
+
+    @property
+    def has_popularity(self):
+        """表中是否有可作为流行度的列（popular 或 source）"""
+        return self._popularity_expression() is not None
+
+    def popularity(self, poem_idxs):
+        """
+        读取诗词的流行度（popular 列的值，或是否来自古诗文网）
+        :return: {下标: 流行度}，已删除的行不包含在结果中；表中没有相关列时返回None
+        """
+        expression = self._popularity_expression()
+        if expression is None:
+            return None
+        with self._lock:
+            if self._conn is None:
+                return {}
+            by_row_id = {self._row_ids[idx]: idx for idx in poem_idxs if idx < len(self._row_ids)}
+            row_ids = list(by_row_id)
+            scores = {}
+            for start in range(0, len(row_ids), 500):
+                chunk = row_ids[start:start + 500]
+                placeholders = ','.join('?' * len(chunk))
+                for row_id, score in self._conn.execute(
+                    f"SELECT rowid, {expression} FROM {self.table_name} WHERE rowid IN ({placeholders})", chunk
+                ):
+                    scores[by_row_id[row_id]] = score or 0
+        return scores
+
+    def shard_ranges(self, shard_count):
+        """
+        将全部诗词按下标均分为若干区间，供并行构建索引使用
+        :return: [(起始下标, 起始行ID, 结束行ID), ...]
+        """
+        total = len(self._row_ids)
+        shard_size = max(1, -(-total // shard_count))
+        return [
+            (start, self._row_ids[start], self._row_ids[min(start + shard_size, total) - 1])
+            for start in range(0, total, shard_size)
+        ]
+
+    @property
+    def row_ids(self):
+        """下标到行ID的映射（升序）"""
+        return self._row_ids
+
+    def index_of(self, row_id):
+        """行ID对应的下标，不存在时返回None"""
+        pos = bisect_left(self._row_ids, row_id)
+        if pos < len(self._row_ids) and self._row_ids[pos] == row_id:
+            return pos
+        return None
+
+    def reload_row_ids(self):
+        """从数据库重新读取行ID（去掉已删除行的占位）"""
+        with self._lock:
+            self._row_ids = array('q', (
+                row[0] for row in self._conn.execute(f"SELECT rowid FROM {self.table_name} ORDER BY rowid")
+            ))
+            self._cache.clear()
+
+    def adopt_row_ids(self, row_ids):
+        """使用索引记录的下标到行ID映射（升序，可包含已删除行的占位）"""
+        with self._lock:
+            self._row_ids = array('q', row_ids)
+            self._cache.clear()
+
+    def fetch(self, row_ids):
+        """
+        批量读取指定行（使用独立连接）
+        :return: {行ID: 诗词}，不存在的行不包含在结果中
+        """
+        row_ids = sorted(row_ids)
+        poems = {}
+        conn = sqlite3.connect(self.db_path)
+        try:
+            for start in range(0, len(row_ids), 500):
+                chunk = row_ids[start:start + 500]
+                placeholders = ','.join('?' * len(chunk))
+                for row in conn.execute(
+                    f"SELECT rowid, {self._select_columns} FROM {self.table_name} WHERE rowid IN ({placeholders})",
+                    chunk,
+                ):
+                    poems[row[0]] = _row_to_poem(row[1:], self.column_names) or self._EMPTY_POEM
+        finally:
+            conn.close()
+        return poems
+
+    def clear(self):
+        """释放数据库连接和缓存"""
+        with self._lock:
+            self._cache.clear()
+            self._row_ids = array('q')
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
 class KnowledgeBaseManager:
-    def __init__(self, db_path='poetry.db', json_path='../poetry_knowledge_base.json', parts_dir='../poetry_db_parts', sample_path='sample_poetry.json', clean_path='clean_poetry.json'):
+    # 索引缓存格式版本号，索引结构变化时递增，使旧缓存自动失效
+    INDEX_CACHE_VERSION = 8
+    # 计算数据库指纹时读取的头尾字节数
+    _SIGNATURE_SAMPLE_SIZE = 1024 * 1024
+    # 诗词数量达到该值才启用多进程构建索引（进程启动开销对小库不划算）
+    PARALLEL_BUILD_MIN_POEMS = 20000
+    # 自动选择进程数时的上限
+    PARALLEL_BUILD_MAX_WORKERS = 8
+    # 分阶段加载时预览索引覆盖的诗词数量
+    PREVIEW_POEM_COUNT = 30000
+    # 默认索引的诗句长度：4/6字词句、5/7字诗句及8字以上的长句
+    DEFAULT_CLAUSE_LENGTHS = (4, 5, 6, 7, 8, 9, 10, 11)
+    # 变化的诗词超过该比例时不再增量更新，改为全量重建
+    DELTA_MAX_FRACTION = 0.1
+    # poetry.db 中记录行变更的表（由触发器写入）
+    _CHANGE_TABLE = 'poem_changes'
+    # 同步答案库时逐条检查的变化诗词上限，超过时直接清空答案库
+    ANSWER_SYNC_MAX_CHANGES = 200
+
+    def __init__(self, db_path='poetry.db', json_path='../poetry_knowledge_base.json', parts_dir='../poetry_db_parts', sample_path='sample_poetry.json', clean_path='clean_poetry.json',
+                 lazy_load=True, poem_cache_size=256, build_workers=None,
+                 result_cache_size=256, result_cache_ttl=None, answer_store_size=5000,
+                 clause_lengths=None, index_couplets=True, track_changes=True, fuzzy_substitutions=1):
         """
         初始化知识库管理器，支持多种数据源
         :param db_path: SQLite数据库路径
@@ -35,6 +615,16 @@ class KnowledgeBaseManager:
         :param parts_dir: 分片数据库目录
         :param sample_path: 示例数据文件路径
         :param clean_path: 清洁数据文件路径
+        :param lazy_load: SQLite数据源是否使用懒加载（只保留诗词ID，内容按需查询）
+        :param poem_cache_size: 懒加载模式下诗词内容LRU缓存的容量
+        :param build_workers: 并行构建索引的进程数，None表示按CPU核数自动选择，1表示串行构建
+        :param result_cache_size: 组字查询结果缓存的容量
+        :param result_cache_ttl: 组字查询结果的有效期（秒），None表示不过期
+        :param answer_store_size: 跨会话答案库保存的答案数量，0表示不持久化
+        :param clause_lengths: 需要索引的诗句长度，None表示使用 DEFAULT_CLAUSE_LENGTHS
+        :param index_couplets: 是否为同一行中相邻两句的连写建立签名，使整联题目可一次查表命中
+        :param track_changes: 是否在poetry.db中用触发器记录行变更，数据库被修改后只增量更新索引
+        :param fuzzy_substitutions: 精确匹配无结果时，允许诗句中有几个字由题目中的形近字代替（容错OCR误识别），0表示不容错
         """
         # 统一使用模块所在目录作为相对路径的基准，确保无论从哪个工作目录启动都能找到数据文件
         self.base_dir = os.path.dirname(os.path.abspath(__file__))
@@ -44,13 +634,49 @@ class KnowledgeBaseManager:
         self.parts_dir = self._resolve_path(parts_dir)
         self.sample_path = self._resolve_path(sample_path)
         self.clean_path = self._resolve_path(clean_path)
+        self.lazy_load = lazy_load
+        self.poem_cache_size = poem_cache_size
+        self.build_workers = build_workers
+        self.clause_lengths = frozenset(clause_lengths or self.DEFAULT_CLAUSE_LENGTHS)
+        self.index_couplets = index_couplets
+        self.track_changes = track_changes
+        # 归一化转换表，构建索引和处理题目时整行一次转换
+        self._char_table = make_char_table(self._CHAR_MAP)
+        self.fuzzy_substitutions = fuzzy_substitutions
+        self._confusion = make_confusion_classes(self._CONFUSABLE_CHARS, self._char_table)
         self.is_loaded = False
         self.poetry_data = []
-        self._poem_cache = {}
-
-        # 倒排索引：{字符: [(poem_idx, clause), ...]}
-        self._char_index = {}
+        # 数据实际来源（'sqlite'/'json'...），只有SQLite来源才使用磁盘索引缓存
+        self._data_source = None
+        # 组字查询结果缓存，键为去除干扰字后的排序字符
+        self._poem_cache = LRUCache(result_cache_size, ttl=result_cache_ttl)
+        # 跨会话答案库（poetry.db.answers），首次使用时打开
+        self.answer_store_size = answer_store_size
+        self._answer_store = None
+        self._answer_store_opened = False
+        self._answer_store_lock = threading.Lock()
+
+        # 诗句索引：列式诗句表 + 字符倒排表（诗句ID数组）+ 字谜签名表
+        self._index = ClauseIndex()
         self._index_built = False
+        # 当前 _index 是否只是高频诗词的预览索引（全量索引在后台构建中）
+        self._index_partial = False
+        # 保证同一时间只有一个线程在构建索引
+        self._index_lock = threading.RLock()
+        # 增量索引：(新增/修改诗词的 ClauseIndex, 需要屏蔽的旧诗词下标集合)，无变化时为None
+        self._delta = None
+        # 磁盘索引记录的构建状态（数据库指纹、归一化表、变更序号）及下标到行ID映射
+        self._index_meta = None
+        self._base_row_ids = None
+        # 磁盘索引和增量索引的内存映射（IndexMapping），重写索引文件或释放时关闭
+        self._index_mapping = None
+        self._delta_mapping = None
+        # 当前索引（含增量）对应的数据库指纹
+        self._index_signature = None
+
+        # 全文检索旁路库（FTS5），就绪前 search 退化为线性扫描
+        self._search_index = None
+        self._search_ready = False
 
         # 尝试不同的数据源
         self._load_data()
@@ -89,109 +715,45 @@ class KnowledgeBaseManager:
             logging.error(f"加载诗词数据失败: {e}")
 
     def _load_from_sqlite(self):
-        """从SQLite数据库加载"""
+        """从SQLite数据库加载（懒加载模式只读取行ID，诗词内容按需查询）"""
         try:
             conn = sqlite3.connect(self.db_path)
             cursor = conn.cursor()
 
-            # 检查表是否存在
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
-            tables = cursor.fetchall()
-
-            if not tables:
-                logging.warning("SQLite数据库中没有找到表")
-                conn.close()
-                return False
-
-            # 优先尝试poems表
-            table_name = 'poems'
             try:
-                cursor.execute(f"SELECT COUNT(*) FROM {table_name}")
-                count = cursor.fetchone()[0]
-                if count == 0:
-                    raise Exception("poems表为空")
-            except:
-                # 如果poems表不存在或为空，尝试其他表
-                for table_tuple in tables:
-                    table_name = table_tuple[0]
-                    if 'poems' in table_name.lower():
-                        try:
-                            cursor.execute(f"SELECT COUNT(*) FROM {table_name}")
-                            count = cursor.fetchone()[0]
-                            if count > 0:
-                                break
-                        except:
-                            continue
-                else:
-                    logging.warning("未找到包含数据的表")
-                    conn.close()
+                detected = _detect_poem_table(cursor)
+                if detected is None:
                     return False
-
-            # 查询数据 - 根据表结构调整
-            try:
-                # 先检查列结构
-                cursor.execute(f"PRAGMA table_info({table_name})")
-                columns = cursor.fetchall()
-                column_names = [col[1] for col in columns]
+                table_name, column_names = detected
 
                 logging.info(f"表 {table_name} 的列: {column_names}")
 
-                # 根据列名构建查询
-                if 'content' in column_names:
-                    # 如果有content列，直接使用（读取全部数据）
-                    cursor.execute(f"SELECT content FROM {table_name}")
-                    rows = cursor.fetchall()
-
-                    for row in rows:
-                        try:
-                            poem = json.loads(row[0])
-                            self.poetry_data.append(poem)
-                        except:
-                            continue
-
-                elif 'title' in column_names and 'author' in column_names:
-                    # 如果有title和author列，构建数据（读取全部数据）
-                    if 'paragraphs' in column_names:
-                        cursor.execute(f"SELECT title, author, paragraphs FROM {table_name}")
-                    else:
-                        cursor.execute(f"SELECT title, author FROM {table_name}")
-
-                    rows = cursor.fetchall()
-
-                    for row in rows:
-                        try:
-                            title = row[0] or '无题'
-                            author = row[1] or '佚名'
-
-                            # 处理内容
-                            if len(row) > 2 and row[2]:
-                                try:
-                                    paragraphs = json.loads(row[2]) if isinstance(row[2], str) else row[2]
-                                    content = paragraphs if isinstance(paragraphs, list) else [str(paragraphs)]
-                                except:
-                                    content = [str(row[2])]
-                            else:
-                                content = []
-
-                            poem = {
-                                'title': title,
-                                'author': author,
-                                'content': content
-                            }
+                if self.lazy_load:
+                    self.poetry_data = LazyPoemStore(
+                        self.db_path, table_name, column_names, cache_size=self.poem_cache_size
+                    )
+                else:
+                    select_columns = _poem_select_columns(column_names)
+                    if select_columns is None:
+                        logging.warning(f"表 {table_name} 缺少可识别的诗词列")
+                        return False
+                    self.poetry_data = []
+                    cursor.execute(f"SELECT {select_columns} FROM {table_name} ORDER BY rowid")
+                    for row in cursor:
+                        poem = _row_to_poem(row, column_names)
+                        if poem is not None:
                             self.poetry_data.append(poem)
-                        except Exception as e:
-                            continue
-
             except Exception as e:
                 logging.error(f"查询数据失败: {e}")
-                conn.close()
                 return False
-
-            conn.close()
+            finally:
+                conn.close()
 
             if self.poetry_data:
                 self.is_loaded = True
-                logging.info(f"从SQLite加载了 {len(self.poetry_data)} 首诗词")
+                self._data_source = 'sqlite'
+                mode = "懒加载" if self.lazy_load else "全量"
+                logging.info(f"从SQLite加载了 {len(self.poetry_data)} 首诗词（{mode}）")
                 return True
 
         except Exception as e:
@@ -283,12 +845,13 @@ class KnowledgeBaseManager:
         if not self.is_loaded:
             raise Exception("无法加载诗词知识库，请检查数据文件是否存在")
 
-    def search(self, query: str, limit: int = 50):
+    def search(self, query: str, limit: int = 50, offset: int = 0):
         """
-        搜索包含查询词的诗词
+        搜索标题、作者或内容包含查询词的诗词
         :param query: 搜索词
         :param limit: 返回结果数量限制
-        :return: 匹配的诗词列表
+        :param offset: 跳过的结果数量（分页）
+        :return: 匹配的诗词列表；全文索引就绪时按相关度排序
         """
         if not self.is_loaded:
             self.ensure_loaded()
@@ -296,10 +859,24 @@ class KnowledgeBaseManager:
         if not query.strip():
             return []
 
-        results = []
         query = query.strip()
 
-        for poem in self.poetry_data:
+        if self._search_ready:
+            try:
+                poem_ids = self._search_index.search(query, limit, offset)
+                poems = (self.poetry_data[poem_idx] for poem_idx in poem_ids)
+                return [poem for poem in poems if poem is not LazyPoemStore._EMPTY_POEM]
+            except Exception as e:
+                logging.warning(f"全文检索失败，改为线性扫描: {e}")
+
+        return self._search_linear(query, limit, offset)
+
+    def _search_linear(self, query, limit, offset):
+        """线性扫描全部诗词（全文索引不可用时的回退路径）"""
+        results = []
+        skipped = 0
+
+        for _, poem in self._iter_present_poems():
             if len(results) >= limit:
                 break
 
@@ -316,150 +893,1151 @@ class KnowledgeBaseManager:
 
             # 如果查询词在标题、作者或内容中出现
             if query in title or query in author or query in content_str:
+                if skipped < offset:
+                    skipped += 1
+                    continue
                 results.append(poem)
 
         return results
 
+    def ensure_search_index(self, rebuild=False):
+        """
+        确保全文检索旁路库可用（后台线程调用）：旁路库与数据库一致时直接启用，否则重新构建
+        只对SQLite数据源生效，其他数据源继续使用线性扫描
+        :param rebuild: 是否忽略已有旁路库强制重建
+        """
+        if (self._search_ready and not rebuild) or self._data_source != 'sqlite':
+            return
+        if not PoemSearchIndex.is_supported():
+            logging.warning("当前SQLite不支持FTS5，搜索将使用线性扫描")
+            return
+
+        self._close_search_index()
+
+        search_index = PoemSearchIndex(self._search_index_path())
+        key = {
+            'signature': self._db_signature(),
+            'poem_count': len(self.poetry_data),
+        }
+        try:
+            if rebuild or not search_index.is_valid(key):
+                logging.info("开始构建全文检索索引...")
+                search_index.build(self._iter_present_poems(), key)
+        except Exception as e:
+            logging.warning(f"构建全文检索索引失败，搜索将使用线性扫描: {e}")
+            return
+
+        self._search_index = search_index
+        self._search_ready = True
+
+    def _close_search_index(self):
+        """关闭全文检索旁路库，搜索回退到线性扫描"""
+        self._search_ready = False
+        if self._search_index is not None:
+            self._search_index.close()
+            self._search_index = None
+
+    def _iter_present_poems(self):
+        """按下标遍历 (下标, 诗词)，跳过已删除行的空诗词占位"""
+        return (
+            (poem_idx, poem) for poem_idx, poem in enumerate(self.poetry_data)
+            if poem is not LazyPoemStore._EMPTY_POEM
+        )
+
     # 常见繁简体和异体字映射（类级别，避免重复创建）
     _CHAR_MAP = {
         '\u5acc': '\u601c',  # 嫌(U+5ACC) -> 怜(U+601C) - 数据库错误：游园不值中应该是"怜"但存储成了"嫌"
     }
 
+    # OCR常见的形近字组（类级别），容错查询时同组的字可以互相代替
+    _CONFUSABLE_CHARS = (
+        '己已巳', '末未', '土士', '日曰', '戊戌戍', '人入八', '刀力', '千干于', '天夭', '王玉',
+        '大太犬', '木本', '免兔', '候侯', '析折拆', '拔拨', '汩汨', '暮幕墓慕募', '辨辩瓣',
+        '睛晴', '问间', '鸟乌', '买卖', '今令', '母毋', '目自', '仑仓', '冶治', '贝见', '斤斥',
+        '苦若', '哀衰衷', '徒徙', '往住', '崇祟', '微徽', '侍待', '竞竟', '旱早', '帅师',
+        '茶荼', '沐沭', '杨扬', '籍藉', '壁璧', '祗祇', '盲肓', '胃胄', '赢羸嬴', '酒洒', '拣捡',
+    )
+
     def _normalize_text(self, text):
         """归一化文本：统一常见异体字/繁简体"""
-        # 快速路径：如果没有需要替换的字符，直接返回
-        if not any(c in self._CHAR_MAP for c in text):
-            return text
+        return normalize_text(text, self._char_table)
+
+    def build_index_staged(self, on_preview=None):
+        """
+        分阶段构建索引（后台线程调用）：索引缓存有效时直接加载；
+        否则先为高频诗词构建预览索引并立即提供查询，再构建全量索引替换它
+        :param on_preview: 预览索引就绪时的回调
+        """
+        with self._index_lock:
+            if self._index_built or not self.is_loaded:
+                return
+
+            if self._load_index_cache():
+                self._index_built = True
+                return
+
+            self._build_preview_index()
+            if on_preview:
+                on_preview()
 
-        # 只在需要时才进行替换
-        return ''.join(self._CHAR_MAP.get(c, c) for c in text)
+            self._build_index(use_cache=False)
 
-    def _build_index(self):
+    def _build_preview_index(self):
+        """为高频诗词构建预览索引，诗词下标与全量索引一致"""
+        start_time = time.perf_counter()
+
+        if isinstance(self.poetry_data, LazyPoemStore):
+            indexed_poems = self.poetry_data.iter_priority(self.PREVIEW_POEM_COUNT)
+        else:
+            indexed_poems = enumerate(islice(self.poetry_data, self.PREVIEW_POEM_COUNT))
+
+        builder = ClauseIndexBuilder(self.index_couplets)
+        _index_poems(indexed_poems, self._char_table, builder, self.clause_lengths)
+        self._index = builder.build()
+        self._index_partial = True
+
+        elapsed = time.perf_counter() - start_time
+        logging.info(f"预览索引构建完成，共 {len(self._index)} 个诗句，耗时 {elapsed:.2f} 秒")
+
+    def _build_index(self, use_cache=True):
         """构建字符倒排索引（后台异步执行）"""
         if self._index_built or not self.is_loaded:
             return
 
-        import re
-        from collections import defaultdict
+        # 数据库未变化时直接加载磁盘上的索引缓存，跳过全量重建
+        if use_cache and self._load_index_cache():
+            self._index_built = True
+            return
 
         logging.info("开始构建诗词索引...")
-        start_time = logging.time if hasattr(logging, 'time') else None
+        start_time = time.perf_counter()
+
+        # 全量构建覆盖之前的所有变更：去掉已删除行的占位，并记录构建时的变更序号
+        if self._index_meta is not None and isinstance(self.poetry_data, LazyPoemStore):
+            self.poetry_data.reload_row_ids()
+        change_seq = self._prepare_change_tracking()
+
+        workers = self._index_build_workers()
+        index = None
+        if workers > 1:
+            index = self._build_index_parallel(workers)
+        if index is None:
+            builder = ClauseIndexBuilder(self.index_couplets)
+            _index_poems(enumerate(self.poetry_data), self._char_table, builder, self.clause_lengths)
+            index = builder.build()
+
+        self._delta = None
+        self._index = index
+        self._index_built = True
+        self._index_partial = False
+        # 旧的映射索引已不再使用，关闭映射后才能在Windows上覆盖索引文件
+        self._close_mappings()
+
+        elapsed = time.perf_counter() - start_time
+        logging.info(
+            f"索引构建完成，共 {len(self._index)} 个诗句，索引了 {len(self._index.postings)} 个字符，"
+            f"耗时 {elapsed:.2f} 秒"
+        )
+        self._log_index_memory()
+
+        self._save_index_cache(change_seq)
+
+    def _index_build_workers(self):
+        """并行构建索引使用的进程数，1表示在当前线程串行构建"""
+        # 只有懒加载的SQLite数据源能让子进程直接按区间读库，其余来源串行构建
+        if not isinstance(self.poetry_data, LazyPoemStore):
+            return 1
+        if len(self.poetry_data) < self.PARALLEL_BUILD_MIN_POEMS:
+            return 1
+        if self.build_workers:
+            return max(1, int(self.build_workers))
+        return min(os.cpu_count() or 1, self.PARALLEL_BUILD_MAX_WORKERS)
+
+    def _build_index_parallel(self, workers):
+        """
+        按诗词区间分片，在多个进程中并行构建索引后按顺序合并
+        :return: ClauseIndex，失败时返回None（由调用方回退到串行构建）
+        """
+        store = self.poetry_data
+        # 分片数多于进程数，让先完成的进程继续领取任务，减少长尾
+        shards = store.shard_ranges(workers * 4)
+        logging.info(f"使用 {workers} 个进程并行构建索引（{len(shards)} 个分片）")
 
-        # 使用defaultdict简化代码
-        char_index = defaultdict(list)
-        split_pattern = re.compile(r'[，。？！,?!；;]')
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = [
+                    executor.submit(
+                        _build_index_shard, store.db_path, store.table_name, store.column_names,
+                        first_rowid, last_rowid, start_idx, self._char_table,
+                        self.clause_lengths, self.index_couplets,
+                    )
+                    for start_idx, first_rowid, last_rowid in shards
+                ]
+                parts_list = [future.result() for future in futures]
+        except Exception as e:
+            logging.warning(f"并行构建索引失败，改为串行构建: {e}")
+            return None
 
-        for poem_idx, poem in enumerate(self.poetry_data):
-            content = poem.get('content', [])
-            if isinstance(content, str):
-                content = [content]
+        return merge_parts(parts_list)
 
-            for line in content:
-                clauses = split_pattern.split(line)
+    def _log_index_memory(self):
+        """记录索引各部分的内存占用"""
+        sizes = self._index.nbytes()
+        total = sum(sizes.values())
+        detail = '，'.join(f"{name} {size / 1024 / 1024:.1f}MB" for name, size in sizes.items())
+        # 内存映射的索引由系统页缓存按需载入，可在多个进程间共享
+        label = "索引映射大小" if isinstance(self._index.table, MappedClauseTable) else "索引内存占用"
+        logging.info(f"{label} {total / 1024 / 1024:.1f}MB（{detail}）")
 
-                for clause in clauses:
-                    clause = clause.strip()
+        breakdown = '，'.join(
+            f"{length}字 {clause_count} 句/倒排 {posting_count} 条"
+            for length, (clause_count, posting_count) in self._index.length_stats.items()
+        )
+        logging.info(f"按长度统计：{breakdown}；相邻两句连写 {len(self._index.pair_sig_hashes)} 组")
 
-                    # 只索引5字或7字诗句
-                    if len(clause) not in [5, 7]:
-                        continue
+    def _index_cache_path(self):
+        """索引缓存文件路径（与poetry.db同目录的旁路文件）"""
+        return self.db_path + '.idx'
+
+    def _search_index_path(self):
+        """全文检索旁路库路径"""
+        return self.db_path + '.fts'
 
-                    # 归一化诗句
-                    normalized_clause = self._normalize_text(clause)
+    def _db_signature(self):
+        """
+        计算数据库指纹：文件大小 + 头尾采样哈希
+        SQLite每次写事务都会递增文件头中的修改计数器，头部采样即可反映内容变化；
+        不使用修改时间，随数据库分发的预构建索引在复制、解压后仍然有效
+        :return: 指纹字典，数据库不存在时返回None
+        """
+        try:
+            stat = os.stat(self.db_path)
+            digest = hashlib.sha1()
+            with open(self.db_path, 'rb') as f:
+                digest.update(f.read(self._SIGNATURE_SAMPLE_SIZE))
+                if stat.st_size > self._SIGNATURE_SAMPLE_SIZE:
+                    f.seek(max(stat.st_size - self._SIGNATURE_SAMPLE_SIZE, self._SIGNATURE_SAMPLE_SIZE))
+                    digest.update(f.read())
+            return {
+                'size': stat.st_size,
+                'hash': digest.hexdigest(),
+            }
+        except OSError:
+            return None
 
-                    # 为诗句中的每个字符建立索引
-                    for char in set(normalized_clause):
-                        char_index[char].append((poem_idx, clause, normalized_clause))
+    def _index_cache_key(self):
+        """
+        索引缓存的校验键：格式版本与索引配置，不一致时必须全量重建；
+        数据库指纹和归一化表记录在索引的附加信息中，变化时可增量更新
+        """
+        return {
+            'version': self.INDEX_CACHE_VERSION,
+            'clause_lengths': sorted(self.clause_lengths),
+            'couplets': self.index_couplets,
+            'lazy_load': self.lazy_load,
+        }
+
+    def _answer_store_key(self):
+        """答案库的校验键：答案取决于索引配置和归一化表；数据库内容的变化按变更记录同步（_sync_answer_store）"""
+        return {
+            **self._index_cache_key(),
+            'char_map': self._CHAR_MAP,
+        }
+
+    def _load_index_cache(self):
+        """
+        尝试从磁盘加载索引缓存；数据库在索引构建后有变化时，只为变化的诗词加载或构建增量索引
+        :return: 是否加载成功
+        """
+        if self._data_source != 'sqlite':
+            return False
 
-        self._char_index = dict(char_index)
-        self._index_built = True
+        cache_path = self._index_cache_path()
+        if not os.path.exists(cache_path):
+            return False
 
-        logging.info(f"索引构建完成，索引了 {len(self._char_index)} 个字符")
+        mapping = None
+        try:
+            start_time = time.perf_counter()
+            # 内存映射打开，各数组直接在映射上查询，无需反序列化
+            loaded = load_index_file(cache_path, self._index_cache_key())
+            if loaded is None:
+                logging.info("索引格式或配置已变化，索引缓存失效，将重新构建")
+                return False
+            index, meta, row_ids, mapping = loaded
+            meta = meta or {}
+
+            signature = self._db_signature()
+            delta = None
+            if meta.get('signature') != signature or meta.get('char_map') != self._CHAR_MAP:
+                delta = self._load_delta_cache(meta, signature) or self._compute_delta(index, meta, row_ids)
+                if delta is None:
+                    logging.info("数据库已变化，索引缓存失效，将重新构建")
+                    mapping.close()
+                    return False
+
+            self._close_mappings()
+            self._delta = None
+            self._index = index
+            self._index_meta = meta
+            self._base_row_ids = row_ids
+            self._index_mapping = mapping
+            self._index_signature = meta.get('signature')
+            elapsed = time.perf_counter() - start_time
+            logging.info(f"从缓存加载索引，共 {len(self._index)} 个诗句，耗时 {elapsed:.3f} 秒")
+            self._log_index_memory()
+            if delta is not None:
+                self._use_delta(delta, signature)
+            return True
+        except Exception as e:
+            logging.warning(f"读取索引缓存失败，将重新构建: {e}")
+            if mapping is not None and mapping is not self._index_mapping:
+                mapping.close()
+            return False
+
+    def _save_index_cache(self, change_seq=None):
+        """
+        将构建好的索引写入磁盘缓存（先写临时文件再替换，避免半写入），
+        写入后改用内存映射的索引，释放构建时占用的Python对象
+        :param change_seq: 构建开始时 poetry.db 的变更序号，None表示数据库不记录变更
+        """
+        self._index_meta = None
+        self._base_row_ids = None
+        self._index_signature = None
+        if self._data_source != 'sqlite':
+            return
+
+        cache_path = self._index_cache_path()
+        tmp_path = cache_path + '.tmp'
+        key = self._index_cache_key()
+        meta = {
+            'signature': self._db_signature(),
+            'char_map': self._CHAR_MAP,
+            'change_seq': change_seq,
+        }
+        row_ids = self.poetry_data.row_ids if isinstance(self.poetry_data, LazyPoemStore) else None
+        try:
+            write_index_file(self._index, tmp_path, key, meta=meta, row_ids=row_ids)
+            os.replace(tmp_path, cache_path)
+            logging.info(f"索引缓存已写入: {cache_path}（{os.path.getsize(cache_path) / 1024 / 1024:.1f}MB）")
+        except Exception as e:
+            logging.warning(f"写入索引缓存失败: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+
+        # 旧的增量索引基于上一份全量索引，已失效
+        try:
+            os.remove(self._delta_cache_path())
+        except OSError:
+            pass
+        # 新索引已落盘，此时才清理它覆盖的变更记录
+        signature = self._prune_change_log(change_seq, meta, row_ids) or meta['signature']
+
+        try:
+            mapped = load_index_file(cache_path, key)
+        except Exception as e:
+            logging.warning(f"映射索引缓存失败: {e}")
+            return
+        if mapped is not None:
+            self._index, self._index_meta, self._base_row_ids, self._index_mapping = mapped
+            self._index_signature = signature
+
+    def _delta_cache_path(self):
+        """增量索引文件路径"""
+        return self._index_cache_path() + '.delta'
+
+    def _prepare_change_tracking(self):
+        """
+        在poetry.db中建立变更记录表及触发器（已存在时不改动数据库），记下构建开始时的变更序号；
+        已被覆盖的记录要等新索引写入成功后才清理（_prune_change_log），构建中断时旧索引仍可增量更新
+        :return: 当前变更序号，未启用、非懒加载数据源或数据库只读时返回None
+        """
+        store = self.poetry_data
+        if not self.track_changes or not isinstance(store, LazyPoemStore):
+            return None
+
+        change_table = self._CHANGE_TABLE
+        try:
+            conn = sqlite3.connect(self.db_path)
+            try:
+                existing = {
+                    row[0] for row in conn.execute(
+                        "SELECT name FROM sqlite_master WHERE name LIKE ?", (change_table + '%',)
+                    )
+                }
+                statements = []
+                if change_table not in existing:
+                    statements.append(
+                        f"CREATE TABLE {change_table} (seq INTEGER PRIMARY KEY AUTOINCREMENT, row_id INTEGER NOT NULL)"
+                    )
+                # 修改可能改变行ID，新旧行ID都记录
+                for event, refs in (('insert', ('NEW',)), ('update', ('OLD', 'NEW')), ('delete', ('OLD',))):
+                    trigger = f"{change_table}_{event}"
+                    if trigger not in existing:
+                        body = ' '.join(f"INSERT INTO {change_table} (row_id) VALUES ({ref}.rowid);" for ref in refs)
+                        statements.append(
+                            f"CREATE TRIGGER {trigger} AFTER {event.upper()} ON {store.table_name} BEGIN {body} END"
+                        )
+
+                store = signature_before = None
+                if statements:
+                    # 安装触发器会改变数据库指纹，答案库先与安装前的数据库同步
+                    store = self._get_answer_store()
+                    signature_before = self._db_signature()
+                    with conn:
+                        for statement in statements:
+                            conn.execute(statement)
+                row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (change_table,)).fetchone()
+                change_seq = row[0] if row else 0
+                if statements:
+                    self._advance_answer_store(store, signature_before, change_seq)
+                return change_seq
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logging.info(f"无法在数据库中记录变更（{e}），数据库变化后将全量重建索引")
+            return None
+
+    def _prune_change_log(self, change_seq, meta, row_ids):
+        """
+        新索引写入成功后，删除其已覆盖的变更记录（序号不超过 change_seq）；
+        删除本身会改变数据库指纹，因此同时写入一份空增量索引，记录删除后的指纹，下次启动无需重建
+        :return: 删除后的数据库指纹，未删除或失败时返回None
+        """
+        if change_seq is None:
+            return None
+        # 答案库按变更记录同步，须在记录被删除前完成
+        store = self._get_answer_store()
+        if store is not None:
+            self._sync_answer_store(store)
+        signature_before = self._db_signature()
+
+        change_table = self._CHANGE_TABLE
+        try:
+            conn = sqlite3.connect(self.db_path)
+            try:
+                with conn:
+                    if not conn.execute(
+                        f"SELECT 1 FROM {change_table} WHERE seq <= ? LIMIT 1", (change_seq,)
+                    ).fetchone():
+                        return None
+                    conn.execute(f"DELETE FROM {change_table} WHERE seq <= ?", (change_seq,))
+                    # 构建期间数据库又有变化时，下次启动按剩余记录增量更新，不记录指纹
+                    pending = conn.execute(
+                        f"SELECT 1 FROM {change_table} WHERE seq > ? LIMIT 1", (change_seq,)
+                    ).fetchone()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logging.info(f"清理数据库变更记录失败: {e}")
+            return None
+        self._advance_answer_store(store, signature_before)
+        if pending:
+            return None
+
+        signature = self._db_signature()
+        delta_meta = {
+            'base_signature': meta['signature'],
+            'signature': signature,
+            'char_map': self._CHAR_MAP,
+            'change_seq': change_seq,
+            'tombstones': [],
+        }
+        if not self._save_delta_cache(ClauseIndexBuilder(self.index_couplets).build(), delta_meta, row_ids):
+            return None
+        return signature
+
+    def _compute_delta(self, index, meta, base_row_ids):
+        """
+        读取全量索引构建后的变更记录，只为新增、修改的诗词构建增量索引，
+        被修改、删除的旧诗词记为墓碑，查询时屏蔽；归一化表变化时，含相关字符的诗词按修改处理
+        :return: (增量索引, 墓碑下标集合, 下标到行ID映射, 附加信息, 内存映射)，
+                 新计算的增量索引在内存中，内存映射为None（启用时写入磁盘）；无法增量更新时返回None
+        """
+        store = self.poetry_data
+        if (not isinstance(store, LazyPoemStore) or base_row_ids is None
+                or meta.get('change_seq') is None):
+            return None
+
+        start_time = time.perf_counter()
+        change_table = self._CHANGE_TABLE
+        try:
+            conn = sqlite3.connect(self.db_path)
+            try:
+                if not conn.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (change_table,)
+                ).fetchone():
+                    return None
+                rows = conn.execute(
+                    f"SELECT seq, row_id FROM {change_table} WHERE seq > ?", (meta['change_seq'],)
+                ).fetchall()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logging.warning(f"读取数据库变更记录失败: {e}")
+            return None
+        # 数据库变化了却没有变更记录（变更发生在触发器之外或记录已被清理），无法确定变化的诗词
+        if not rows and meta.get('signature') != self._db_signature():
+            logging.info("数据库已变化但没有对应的变更记录，将全量重建索引")
+            return None
+        changed_row_ids = {row_id for _, row_id in rows}
+        change_seq = max((seq for seq, _ in rows), default=meta['change_seq'])
+
+        old_map = meta.get('char_map') or {}
+        table = index.table
+        for char in set(old_map) | set(self._CHAR_MAP):
+            if old_map.get(char) == self._CHAR_MAP.get(char):
+                continue
+            # 旧索引中该字符归一化为 old_map 的目标字，按原文确认诗句确实含有该字符
+            for posting_char in {char, old_map.get(char, char)}:
+                for clause_id in index.posting(posting_char):
+                    if char in table.clause(clause_id):
+                        changed_row_ids.add(base_row_ids[table.poem_ids[clause_id]])
+
+        if len(changed_row_ids) > max(1, int(len(base_row_ids) * self.DELTA_MAX_FRACTION)):
+            logging.info(f"变化的诗词过多（{len(changed_row_ids)} 首），将全量重建索引")
+            return None
+
+        poems = store.fetch(changed_row_ids)
+        base_max = base_row_ids[-1] if len(base_row_ids) else 0
+        tombstones = set()
+        indexed_poems = []
+        appended = []
+        for row_id in changed_row_ids:
+            pos = bisect_left(base_row_ids, row_id)
+            if pos < len(base_row_ids) and base_row_ids[pos] == row_id:
+                tombstones.add(pos)
+                if row_id in poems:
+                    indexed_poems.append((pos, poems[row_id]))
+            elif row_id in poems:
+                # 新行插入到已有行ID之间时下标无法保持稳定
+                if row_id < base_max:
+                    return None
+                appended.append(row_id)
+
+        appended.sort()
+        row_ids = array('q', base_row_ids)
+        row_ids.extend(appended)
+        indexed_poems.extend(
+            (len(base_row_ids) + offset, poems[row_id]) for offset, row_id in enumerate(appended)
+        )
+        indexed_poems.sort(key=lambda item: item[0])
+
+        builder = ClauseIndexBuilder(self.index_couplets)
+        _index_poems(indexed_poems, self._char_table, builder, self.clause_lengths)
+        delta = builder.build()
+
+        delta_meta = {
+            'base_signature': meta.get('signature'),
+            'signature': self._db_signature(),
+            'char_map': self._CHAR_MAP,
+            'change_seq': change_seq,
+            'tombstones': sorted(tombstones),
+        }
+        elapsed = time.perf_counter() - start_time
+        logging.info(
+            f"增量更新索引：修改/删除 {len(tombstones)} 首，新增 {len(appended)} 首，"
+            f"增量 {len(delta)} 个诗句，耗时 {elapsed:.2f} 秒"
+        )
+        return delta, frozenset(tombstones), row_ids, delta_meta, None
+
+    def _save_delta_cache(self, delta, meta, row_ids):
+        """
+        将增量索引写入磁盘，下次启动数据库未再变化时直接加载
+        :return: 是否写入成功
+        """
+        path = self._delta_cache_path()
+        tmp_path = path + '.tmp'
+        try:
+            write_index_file(delta, tmp_path, self._index_cache_key(), meta=meta, row_ids=row_ids)
+            os.replace(tmp_path, path)
+            return True
+        except Exception as e:
+            logging.warning(f"写入增量索引失败: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return False
+
+    def _load_delta_cache(self, meta, signature):
+        """
+        加载磁盘上的增量索引（须基于同一份全量索引且与当前数据库一致）
+        :return: 同 _compute_delta，不可用时返回None
+        """
+        path = self._delta_cache_path()
+        if not os.path.exists(path):
+            return None
+        try:
+            loaded = load_index_file(path, self._index_cache_key())
+        except Exception as e:
+            logging.warning(f"读取增量索引失败: {e}")
+            return None
+        if loaded is None:
+            return None
+        delta, delta_meta, row_ids, mapping = loaded
+        if (not delta_meta or row_ids is None
+                or delta_meta.get('base_signature') != meta.get('signature')
+                or delta_meta.get('signature') != signature
+                or delta_meta.get('char_map') != self._CHAR_MAP):
+            mapping.close()
+            return None
+        logging.info(f"加载增量索引，共 {len(delta)} 个诗句")
+        return delta, frozenset(delta_meta['tombstones']), row_ids, delta_meta, mapping
+
+    def _use_delta(self, delta, signature):
+        """
+        启用增量索引：先切换下标映射（只在末尾追加），再替换增量索引；
+        新计算的增量索引在关闭旧的映射后写入磁盘
+        """
+        delta_index, tombstones, row_ids, meta, mapping = delta
+        self.poetry_data.adopt_row_ids(row_ids)
+        self._delta = (delta_index, tombstones) if len(delta_index) or tombstones else None
+        self._index_signature = signature
+        old_mapping, self._delta_mapping = self._delta_mapping, mapping
+        if old_mapping is not None:
+            old_mapping.close()
+        if mapping is None:
+            self._save_delta_cache(delta_index, meta, row_ids)
+
+    def _close_mappings(self):
+        """关闭磁盘索引和增量索引的内存映射（映射上的索引此后不可再查询）"""
+        for mapping in (self._index_mapping, self._delta_mapping):
+            if mapping is not None and not mapping.close():
+                logging.info("索引映射仍被引用，将在引用释放后关闭")
+        self._index_mapping = None
+        self._delta_mapping = None
+
+    def refresh_index(self):
+        """
+        检查poetry.db在索引构建后是否被修改（补录、订正诗词等），
+        只为变化的诗词更新增量索引（内存和磁盘），无法增量更新时全量重建
+        :return: 索引是否有更新
+        """
+        with self._index_lock:
+            if not self._index_built or self._data_source != 'sqlite':
+                return False
+            signature = self._db_signature()
+            if signature == self._index_signature:
+                return False
+
+            delta = None
+            if self._index_meta is not None:
+                delta = self._compute_delta(self._index, self._index_meta, self._base_row_ids)
+            if delta is not None:
+                self._use_delta(delta, signature)
+            else:
+                logging.info("数据库已变化，全量重建索引")
+                self._index_built = False
+                self._build_index(use_cache=False)
+
+            # 全文索引按诗词下标保存，全量重建会重新编号、增量更新会留下已删除诗词的占位，需随之重建
+            search_was_ready = self._search_ready
+            self._close_search_index()
+            if search_was_ready:
+                self.ensure_search_index()
+
+            # 结果缓存和答案库可能包含已修改的诗词
+            self._poem_cache.clear()
+            with self._answer_store_lock:
+                if self._answer_store is not None:
+                    self._answer_store.close()
+                    self._answer_store = None
+                self._answer_store_opened = False
+            return True
 
     def ensure_index(self):
-        """确保索引已构建"""
+        """确保索引已构建（其他线程正在构建时等待其完成）"""
         if not self._index_built:
-            self._build_index()
+            with self._index_lock:
+                self._build_index()
 
     def find_poem_from_chars(self, chars):
         """
         从给定字符中查找可以组成的诗句
         :param chars: 可用字符
-        :return: [(poem_dict, matched_clauses), ...] 或 None
+        :return: PoemMatches([(poem_dict, matched_clauses), ...]) 或 None；
+                 全量索引未就绪时先查预览索引，命中的结果 partial 为 True
         """
         if not self.is_loaded:
             self.ensure_loaded()
 
-        clean_chars = chars.strip()
-        if not clean_chars:
+        if not chars.strip():
             return None
 
-        # 归一化输入字符
-        clean_chars = self._normalize_text(clean_chars)
-
-        normalized_key = ''.join(sorted(clean_chars))
-        if normalized_key in self._poem_cache:
-            return self._poem_cache[normalized_key]
+        # 索引就绪前先查跨会话答案库：重复出现的题目在冷启动时也能立即作答
+        raw_key = None
+        if not self._index_built:
+            raw_key = ''.join(sorted(self._normalize_text(''.join(chars.split()))))
+            stored = self._load_stored_answer(raw_key)
+            if stored:
+                return stored
+
+        # 全量索引还在构建时先查预览索引；预览未命中再等待全量索引
+        if not self._index_built and self._index_partial:
+            index = self._index
+            query = self._prepare_query(chars, index)
+            if query is not None:
+                preview = self._match_queries(index, [query])[0]
+                if preview:
+                    return self._to_matches(preview, partial=True)
 
         # 确保索引已构建
         self.ensure_index()
 
-        from collections import Counter
+        # 先取全量索引再取增量索引：全量重建时先清空增量索引，保证墓碑不会作用到新索引上
+        index = self._index
+        delta = self._delta
+        query = self._prepare_query(chars, index, delta)
+        if query is None:
+            return None
 
-        chars_counter = Counter(clean_chars)
-        chars_set = set(clean_chars)
+        cached = self._poem_cache.get(query.key)
+        if cached is not LRUCache.MISSING:
+            return cached
+
+        results = self._match_queries(index, [query], delta)[0]
+        fuzzy = False
+        fuzzy_query = None if results else self._fuzzy_query(query)
+        if fuzzy_query is not None:
+            results = self._match_queries(index, [fuzzy_query], delta)[0]
+            fuzzy = bool(results)
+        outcome = self._to_matches(results, fuzzy=fuzzy)
+        self._poem_cache.put(query.key, outcome)
+        # 容错结果只是推测，不写入答案库
+        if results and not fuzzy:
+            # 同时保存索引就绪前使用的原始键，下次冷启动可直接命中
+            entries = [(query.key, results)]
+            if raw_key and raw_key != query.key:
+                entries.append((raw_key, results))
+            self._store_answers(entries)
+        return outcome
 
-        # 使用索引快速查找候选诗句
-        # 策略：找出题目中最少见的字符，从它的索引开始
-        candidate_clauses = set()
+    def find_poems_from_chars_batch(self, char_sets):
+        """
+        批量查找诗句（回放录制的答题记录、预热答案等场景）
+        共享最少见字符的查询归为一组，每组的倒排表只扫描一遍
+        :param char_sets: 可用字符列表
+        :return: 与输入顺序一致的结果列表，每项同 find_poem_from_chars
+        """
+        if not self.is_loaded:
+            self.ensure_loaded()
+        self.ensure_index()
 
-        # 找到索引最小的字符（最不常见）
-        min_char = None
-        min_count = float('inf')
+        index = self._index
+        delta = self._delta
+        outcomes = [None] * len(char_sets)
+        # {查询键: (查询, [输入位置, ...])}，相同的字符集只查一次
+        pending = {}
+        for position, chars in enumerate(char_sets):
+            query = self._prepare_query(chars, index, delta)
+            if query is None:
+                continue
+            cached = self._poem_cache.get(query.key)
+            if cached is not LRUCache.MISSING:
+                outcomes[position] = cached
+                continue
+            if query.key in pending:
+                pending[query.key][1].append(position)
+            else:
+                pending[query.key] = (query, [position])
+
+        queries = [query for query, _ in pending.values()]
+        all_results = self._match_queries(index, queries, delta)
+
+        # 精确匹配无结果的查询再统一做一次容错查询
+        fuzzy_positions = []
+        fuzzy_queries = []
+        for position, (query, results) in enumerate(zip(queries, all_results)):
+            fuzzy_query = None if results else self._fuzzy_query(query)
+            if fuzzy_query is not None:
+                fuzzy_positions.append(position)
+                fuzzy_queries.append(fuzzy_query)
+        fuzzy_flags = [False] * len(queries)
+        if fuzzy_queries:
+            for position, results in zip(fuzzy_positions, self._match_queries(index, fuzzy_queries, delta)):
+                all_results[position] = results
+                fuzzy_flags[position] = bool(results)
+
+        stored_entries = []
+        for (query, positions), results, fuzzy in zip(pending.values(), all_results, fuzzy_flags):
+            outcome = self._to_matches(results, fuzzy=fuzzy)
+            self._poem_cache.put(query.key, outcome)
+            if results and not fuzzy:
+                stored_entries.append((query.key, results))
+            for position in positions:
+                outcomes[position] = outcome
+        self._store_answers(stored_entries)
+
+        return outcomes
+
+    def _get_answer_store(self):
+        """打开跨会话答案库（仅SQLite数据源），不可用时返回None"""
+        if self._answer_store_opened:
+            return self._answer_store
+        with self._answer_store_lock:
+            if not self._answer_store_opened:
+                if self._data_source == 'sqlite' and self.answer_store_size > 0:
+                    self._answer_store = AnswerStore.open(
+                        self.db_path + '.answers', self._answer_store_key(), max_entries=self.answer_store_size
+                    )
+                    if self._answer_store is not None:
+                        self._sync_answer_store(self._answer_store)
+                self._answer_store_opened = True
+        return self._answer_store
+
+    def _sync_answer_store(self, store):
+        """
+        使答案库与当前数据库一致：数据库指纹未变时不做处理；否则读取答案库记录的变更序号之后的变更，
+        只淘汰引用了变化诗词、或其字符能组成变化诗词中某一句的答案；
+        数据库变化却没有对应的变更记录（不记录变更、记录已被清理）或变化过多时清空答案库
+        """
+        try:
+            signature = self._db_signature()
+            state = store.state
+            if state is not None and state.get('signature') == signature:
+                return
+
+            change_seq, changed = None, None
+            if self.track_changes and isinstance(self.poetry_data, LazyPoemStore):
+                change_seq, changed = self._read_changes(state.get('change_seq') if state else None)
+
+            if state is None:
+                store.clear()
+            elif not changed or len(changed) > self.ANSWER_SYNC_MAX_CHANGES:
+                logging.info("数据库已变化，清空已保存的答案")
+                store.clear()
+            else:
+                builder = ClauseIndexBuilder(False)
+                _index_poems(enumerate(self.poetry_data.fetch(changed).values()), self._char_table, builder,
+                             self.clause_lengths)
+                table = builder.build().table
+                clauses = [Counter(table.normalized_clause(i)) for i in range(len(table))]
+
+                def affected(key, refs):
+                    if any(ref in changed for ref, _ in refs):
+                        return True
+                    available = Counter(key)
+                    return any(not clause - available for clause in clauses)
+
+                evicted = store.evict(affected)
+                logging.info(f"数据库有 {len(changed)} 首诗词变化，淘汰 {evicted} 条已保存的答案")
+            store.set_state({'signature': signature, 'change_seq': change_seq})
+        except Exception as e:
+            logging.warning(f"同步答案库失败，清空已保存的答案: {e}")
+            store.clear()
 
-        for char in chars_set:
-            if char in self._char_index:
-                count = len(self._char_index[char])
-                if count < min_count:
-                    min_count = count
-                    min_char = char
+    def _advance_answer_store(self, store, signature_before, change_seq=None):
+        """
+        本类自身改写poetry.db（安装触发器、清理变更记录）不改变诗词内容，
+        答案库与改写前的数据库一致时，把记录的指纹推进到改写后的指纹
+        :param change_seq: 答案库尚未记录变更序号时使用的序号
+        """
+        if store is None:
+            return
+        state = store.state
+        if state is None or state.get('signature') != signature_before:
+            return
+        if state.get('change_seq') is None:
+            state['change_seq'] = change_seq
+        store.set_state({**state, 'signature': self._db_signature()})
 
-        if min_char is None:
-            # 没有任何字符在索引中
-            outcome = None
-        else:
-            # 从最少见的字符开始，获取候选诗句
-            for poem_idx, clause, normalized_clause in self._char_index[min_char]:
-                # 快速检查：诗句的所有字符都在题目中
-                if all(c in chars_set for c in normalized_clause):
-                    # 精确检查字符数量
-                    clause_counter = Counter(normalized_clause)
-                    if all(clause_counter[c] <= chars_counter[c] for c in clause_counter):
-                        candidate_clauses.add((poem_idx, clause))
+    def _read_changes(self, after_seq):
+        """
+        读取poetry.db的变更记录
+        :param after_seq: 只读取序号大于它的记录，None表示不读取
+        :return: (当前变更序号, 变化的行ID集合或None)；数据库不记录变更时返回 (None, None)
+        """
+        change_table = self._CHANGE_TABLE
+        try:
+            conn = sqlite3.connect(self.db_path)
+            try:
+                if not conn.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (change_table,)
+                ).fetchone():
+                    return None, None
+                row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (change_table,)).fetchone()
+                if after_seq is None:
+                    return (row[0] if row else 0), None
+                changed = {
+                    row_id for (row_id,) in conn.execute(
+                        f"SELECT row_id FROM {change_table} WHERE seq > ?", (after_seq,)
+                    )
+                }
+                return (row[0] if row else 0), changed
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logging.warning(f"读取数据库变更记录失败: {e}")
+            return None, None
+
+    def _load_stored_answer(self, key):
+        """从答案库读取答案并转换为 PoemMatches，不存在时返回None"""
+        store = self._get_answer_store()
+        if store is None:
+            return None
+        try:
+            stored = store.get(key)
+        except Exception as e:
+            logging.warning(f"读取答案库失败: {e}")
+            return None
+        if not stored:
+            return None
+        poetry_data = self.poetry_data
+        if isinstance(poetry_data, LazyPoemStore):
+            # 答案库保存的是行ID，转换为当前下标（增量更新后下标映射可能包含占位）
+            stored = [(poetry_data.index_of(row_id), clauses) for row_id, clauses in stored]
+            if any(poem_idx is None for poem_idx, _ in stored):
+                return None
+        logging.info("本地知识库 - 命中已保存的答案")
+        return self._to_matches(stored)
+
+    def _store_answers(self, entries):
+        """将答案写入答案库（懒加载数据源保存行ID，与下标映射无关）"""
+        if not entries:
+            return
+        store = self._get_answer_store()
+        if store is None:
+            return
+        poetry_data = self.poetry_data
+        if isinstance(poetry_data, LazyPoemStore):
+            row_ids = poetry_data.row_ids
+            entries = [
+                (key, [(row_ids[poem_idx], clauses) for poem_idx, clauses in results])
+                for key, results in entries
+            ]
+        try:
+            store.put_many(entries)
+        except Exception as e:
+            logging.warning(f"写入答案库失败: {e}")
 
-            # 组织结果：按诗词分组
-            results_dict = {}
-            for poem_idx, clause in candidate_clauses:
-                if poem_idx not in results_dict:
-                    results_dict[poem_idx] = []
-                results_dict[poem_idx].append(clause)
+    def _to_matches(self, results, partial=False, fuzzy=False):
+        """将 [(poem_idx, clauses), ...] 转换为 PoemMatches([(poem_dict, clauses), ...])，为空时返回None"""
+        if not results:
+            return None
+        return PoemMatches(
+            [(self.poetry_data[poem_idx], clauses) for poem_idx, clauses in results],
+            partial=partial, fuzzy=fuzzy,
+        )
 
-            # 转换为原格式
-            results = []
-            for poem_idx, clauses in sorted(results_dict.items())[:10]:
-                poem = self.poetry_data[poem_idx]
-                results.append((poem, clauses))
+    def _prepare_query(self, chars, index, delta=None):
+        """
+        归一化题目字符、去除干扰字并预先计算匹配所需的数据，无有效字符时返回None
+        不出现在任何诗句中的字（OCR噪声、数字、标点等）不可能参与组句，去掉后结果不变，
+        同一题目多次截图得到的噪声不同也能命中同一个缓存键
+        :param delta: 增量索引 (ClauseIndex, 墓碑下标集合)，新增诗词中的字同样保留
+        """
+        # 归一化输入字符
+        clean_chars = self._normalize_text(chars.strip())
+        delta_index = delta[0] if delta is not None else None
+        # 容错查询时，库中没有但有形近字的字可能是OCR误识别，同样保留
+        confusion = self._confusion if self.fuzzy_substitutions else {}
+        clean_chars = ''.join(
+            c for c in clean_chars
+            if index.posting(c) or (delta_index is not None and delta_index.posting(c)) or c in confusion
+        )
+        if not clean_chars:
+            return None
+        return _ClauseQuery(clean_chars)
+
+    def _fuzzy_query(self, query):
+        """
+        为精确查询生成对应的容错查询；题目中没有任何字属于形近字组时容错也不会有结果，返回None
+        """
+        if not self.fuzzy_substitutions:
+            return None
+        confusion = self._confusion
+        if not any(char in confusion for char in query.chars_set):
+            return None
+        return _ClauseQuery(query.clean_chars, confusion, self.fuzzy_substitutions)
 
-            outcome = results[:5] if results else None
+    def cache_stats(self):
+        """组字查询结果缓存的命中统计"""
+        return self._poem_cache.stats()
 
-        # 缓存结果
-        if len(self._poem_cache) >= 32:
-            try:
-                self._poem_cache.pop(next(iter(self._poem_cache)))
-            except StopIteration:
-                pass
-        self._poem_cache[normalized_key] = outcome
-        return outcome
+    def _match_queries(self, index, queries, delta=None):
+        """
+        在指定索引（及增量索引）中为一组查询查找可组成的诗句
+        :param delta: 增量索引 (ClauseIndex, 墓碑下标集合)，墓碑中的诗词不再从 index 返回
+        :return: 与 queries 顺序一致的 [(poem_idx, matched_clauses), ...] 列表，未找到时为空列表
+        """
+        layers = [(index, delta[1] if delta is not None else None)]
+        if delta is not None:
+            layers.append((delta[0], None))
+
+        ranked = [[] for _ in queries]
+        for layer, excluded in layers:
+            for query in queries:
+                query.candidates = set()
+            self._collect_candidates(layer, queries, excluded)
+            for query, entries in zip(queries, ranked):
+                popularity = self._poem_popularity(layer, query.candidates)
+                entries.extend(self._score_candidates(layer, query, excluded, popularity))
+        return [self._group_ranked(entries) for entries in ranked]
+
+    def _poem_popularity(self, index, candidates):
+        """
+        候选诗句所属诗词在 poetry.db 中记录的流行度
+        :return: {poem_idx: 流行度}，数据源没有 popular/source 列时返回None（改用签名计数）
+        """
+        store = self.poetry_data
+        if not candidates or not isinstance(store, LazyPoemStore) or not store.has_popularity:
+            return None
+        poem_ids = index.table.poem_ids
+        return store.popularity({poem_ids[clause_id] for clause_id in candidates})
+
+    def _collect_candidates(self, index, queries, excluded=None):
+        """在一个索引中收集每个查询的候选诗句ID（写入 query.candidates）"""
+        table = index.table
+        # {最少见字符: [查询, ...]}
+        groups = {}
+
+        for query in queries:
+            # 快速路径：题目给出的字恰好组成一句诗句或相邻两句时，一次签名查表即可命中
+            # （签名只能精确匹配，容错查询直接扫描锚点倒排表）
+            if not query.max_substitutions and self._signature_candidates(index, query, excluded):
+                continue
+
+            # 策略：每个诗句只登记在它最少见的字符下，扫描题目中每个字的锚点倒排表，
+            # 即可不重不漏地覆盖所有候选（题目中最少见的字可能是干扰字，不能只扫描它的倒排表）；
+            # 容错查询的 chars_set 含有题目字的形近字，含形近字的诗句同样会被扫描到
+            for char in query.chars_set:
+                if index.anchor_posting(char):
+                    groups.setdefault(char, []).append(query)
+
+        # 同组查询共享一次倒排表扫描
+        for anchor_char, group in groups.items():
+            self._scan_posting(table, index.anchor_posting(anchor_char), group)
+
+    @staticmethod
+    def _signature_candidates(index, query, excluded=None):
+        """按签名查找恰好由题目的字组成的诗句或相邻两句，写入 query.candidates，返回是否命中"""
+        table = index.table
+        if len(query.clean_chars) in index.length_stats:
+            signature_hits = index.lookup_signature(query.key)
+            if excluded:
+                signature_hits = [c for c in signature_hits if table.poem_ids[c] not in excluded]
+            if signature_hits:
+                query.candidates.update(signature_hits)
+                return True
+        pair_hits = index.lookup_pair_signature(query.key)
+        if excluded:
+            pair_hits = [c for c in pair_hits if table.poem_ids[c] not in excluded]
+        if pair_hits:
+            query.candidates.update(pair_hits)
+            query.candidates.update(clause_id + 1 for clause_id in pair_hits)
+            return True
+        return False
+
+    @staticmethod
+    def _scan_posting(table, posting, group):
+        """扫描一个倒排表，把每个诗句与同组的所有查询逐一比对"""
+        from collections import Counter
+
+        clause_masks = table.masks
+        for clause_id in posting:
+            clause_mask = clause_masks[clause_id]
+            normalized_clause = None
+            for query in group:
+                # 快速检查：位掩码过滤，绝大多数候选在这里被一次整数运算排除
+                if clause_mask & query.excluded_bits:
+                    continue
+                if normalized_clause is None:
+                    normalized_clause = table.normalized_clause(clause_id)
+                    clause_counter = Counter(normalized_clause)
+                chars_set = query.chars_set
+                # 位掩码存在散列碰撞，仍需确认诗句的所有字符都在题目中
+                if all(c in chars_set for c in normalized_clause):
+                    if query.max_substitutions:
+                        # 容错查询：缺少的字由题目中多出的形近字代替
+                        if query.substitutions(clause_counter) is not None:
+                            query.candidates.add(clause_id)
+                        continue
+                    # 精确检查字符数量
+                    chars_counter = query.counter
+                    if all(clause_counter[c] <= chars_counter[c] for c in clause_counter):
+                        query.candidates.add(clause_id)
+
+    @staticmethod
+    def _score_candidates(index, query, excluded=None, popularity=None):
+        """
+        为一个索引中的候选诗句打分，只对过滤后的候选打分，不增加扫描量
+        :param excluded: 需要屏蔽的诗词下标（墓碑）
+        :param popularity: {poem_idx: 流行度}，来自 poetry.db 的 popular/source 列；
+                           None时以相同字符组合的诗句在库中出现的次数作为流行度
+        :return: [(用字数, 最长句长, 流行度, poem_idx, 诗句ID元组, [诗句, ...]), ...]；
+                 容错查询的用字数不计由形近字代替的字，精确组成的诗句排在前面
+        """
+        table = index.table
+        poem_ids = table.poem_ids
+        candidates = query.candidates
+        if excluded:
+            candidates = {c for c in candidates if poem_ids[c] not in excluded}
+        offsets = table.offsets
+        # 每项：(用字数, 最长句长, 流行度, 诗句ID元组)
+        entries = []
+        for clause_id in candidates:
+            length = offsets[clause_id + 1] - offsets[clause_id]
+            normalized_clause = table.normalized_clause(clause_id)
+            if popularity is not None:
+                score = popularity.get(poem_ids[clause_id], 0)
+            else:
+                score = index.signature_count(''.join(sorted(normalized_clause)))
+            used = length
+            if query.max_substitutions:
+                used -= query.substitutions(Counter(normalized_clause))
+            entries.append((used, length, score, (clause_id,)))
+
+        # 原诗中相邻的两句都可由题目组成时，检查两句合起来字数是否仍够用
+        singles = {entry[3][0]: entry for entry in entries}
+        joins_next = table.joins_next
+        for clause_id in candidates:
+            next_id = clause_id + 1
+            if not joins_next[clause_id] or next_id not in candidates:
+                continue
+            pair_counter = Counter(table.normalized_clause(clause_id))
+            pair_counter.update(table.normalized_clause(next_id))
+            substitutions = query.substitutions(pair_counter)
+            if substitutions is not None:
+                first, second = singles[clause_id], singles[next_id]
+                entries.append((
+                    first[1] + second[1] - substitutions, max(first[1], second[1]),
+                    max(first[2], second[2]), (clause_id, next_id),
+                ))
+
+        return [
+            (used, longest, popularity, poem_ids[clause_ids[0]], clause_ids,
+             [table.clause(clause_id) for clause_id in clause_ids])
+            for used, longest, popularity, clause_ids in entries
+        ]
+
+    @staticmethod
+    def _group_ranked(entries, max_poems=5):
+        """
+        排序并按诗词分组为 [(poem_idx, matched_clauses), ...]
+        排序依据依次为：用到的题目字数（相邻两句合起来用完题目的字时按两句计）、
+        诗句长度（长句优先，如7字优先于5字）、流行度（poetry.db 的 popular/source 列，
+        没有时取相同字符组合的诗句在库中出现的次数，名句常被引用）、
+        诗词下标；诗词顺序取其最佳候选的名次，句子按名次排列并去重
+        """
+        entries.sort(key=lambda e: (-e[0], -e[1], -e[2], e[3], e[4]))
+
+        results = {}
+        for entry in entries:
+            poem_idx = entry[3]
+            clauses = results.get(poem_idx)
+            if clauses is None:
+                if len(results) >= max_poems:
+                    continue
+                clauses = results[poem_idx] = []
+            for clause in entry[5]:
+                if clause not in clauses:
+                    clauses.append(clause)
+
+        return list(results.items())
 
     def _resolve_path(self, path):
         """将传入路径解析为绝对路径，保留外部传入的绝对路径"""
@@ -471,11 +2049,29 @@ class KnowledgeBaseManager:
 
     def release(self):
         """释放内存占用，便于应用退出时清理资源"""
+        stats = self._poem_cache.stats()
+        if stats['hits'] or stats['misses']:
+            logging.info(
+                f"结果缓存统计: 命中 {stats['hits']}，未命中 {stats['misses']}，"
+                f"淘汰 {stats['evictions']}，过期 {stats['expirations']}，命中率 {stats['hit_rate']:.1%}"
+            )
         self.poetry_data.clear()
         self.is_loaded = False
         self._poem_cache.clear()
-        self._char_index.clear()
+        self._index = ClauseIndex()
         self._index_built = False
+        self._index_partial = False
+        if self._answer_store is not None:
+            self._answer_store.close()
+            self._answer_store = None
+        self._answer_store_opened = False
+        self._close_search_index()
+        self._delta = None
+        self._index_meta = None
+        self._base_row_ids = None
+        self._close_mappings()
+        self._index_signature = None
+        self._data_source = None
 
 # 测试代码
 if __name__ == '__main__':
@@ -2,11 +2,11 @@ import customtkinter as ctk
 from tkinter import messagebox
 import threading
 import json
-import re
 import os
 import logging
 import sys
 import ctypes
+import multiprocessing
 
 from ui import (
     DEFAULT_THEME,
@@ -24,7 +24,6 @@ from ui import (
 # 应用配置常量
 APP_CONFIG = {
     'WINDOW_SIZE': '1080x720',
-    'MAX_AI_CONCURRENT': 2,
     'MAX_POEM_RESULTS': 5,
     'MAX_DISPLAYED_ANSWERS': 2,
     'MAX_DISPLAYED_POEMS': 2,
@@ -49,6 +48,8 @@ from ai_manager import AIManager
 from ocr_manager import OCRManager
 from settings_window import SettingsWindow
 from knowledge_base_manager import KnowledgeBaseManager
+from question_parser import extract_poem_chars, format_question_text
+from answer_parser import parse_answer
 
 class QuestionAssistant(ctk.CTk):
     def __init__(self):
@@ -71,7 +72,13 @@ class QuestionAssistant(ctk.CTk):
         self.kb_manager = KnowledgeBaseManager()
         
         self.answer_widgets = {}
+        # 各AI卡片已收到的回答文本，用于流式更新高亮预览
+        self.answer_texts = {}
         self.highlight_populated = False
+        # 截图区域打开期间定时预热连接的 after 任务
+        self._warm_up_job = None
+        # 当前题目的AI请求（AnswerRun），换题或退出时取消
+        self._ai_run = None
 
         self.load_settings()
         self.create_widgets()
@@ -236,15 +243,20 @@ class QuestionAssistant(ctk.CTk):
 
         self.kb_manager.ensure_loaded() # This is the blocking call
 
-        # 立即构建索引（后台异步）
+        # 立即构建索引（后台异步）；首次构建时先提供高频诗词的预览索引
         self.after(0, self.status_var.set, "知识库加载完毕，正在构建索引...")
-        self.kb_manager._build_index()  # 构建倒排索引
+        self.kb_manager.build_index_staged(
+            on_preview=lambda: self.after(0, self.status_var.set, "常用诗词已可查询，正在构建完整索引...")
+        )
 
         self.after(0, self.progress_bar.stop)
         self.after(0, self.progress_bar.grid_remove) # Hide progress bar
         self.after(0, self.status_var.set, "就绪，索引已优化。")
         self.after(0, lambda: self.header_status_label.configure(text="已优化"))
 
+        # 全文检索索引不影响诗词组字题，放在最后构建
+        self.kb_manager.ensure_search_index()
+
     def toggle_screenshot_area(self):
         if self.screenshot_tool.is_active:
             self.screenshot_tool.hide_overlay()
@@ -260,8 +272,13 @@ class QuestionAssistant(ctk.CTk):
                 text_color=self.theme.colors["text_primary"]
             )
             self.header_status_label.configure(text="就绪")
+            if self._warm_up_job is not None:
+                self.after_cancel(self._warm_up_job)
+                self._warm_up_job = None
         else:
             self.screenshot_tool.show_overlay()
+            # 打开截图区域说明即将提问，提前建立与AI和OCR服务的连接
+            self._warm_up_connections()
             self.screenshot_btn.configure(
                 text="隐藏截图区域",
                 fg_color=self.theme.colors["surface_soft"],
@@ -276,46 +293,28 @@ class QuestionAssistant(ctk.CTk):
             )
             self.header_status_label.configure(text="截图模式")
 
+    def _warm_up_connections(self):
+        """截图区域打开期间，按预热间隔在后台重复预热AI与OCR连接"""
+        self._warm_up_job = None
+        interval = self.ai_manager.warmup_interval
+        if not interval or not self.screenshot_tool.is_active:
+            return
+        threading.Thread(target=self._warm_up_thread, args=(interval,), daemon=True).start()
+        self._warm_up_job = self.after(int(interval * 1000), self._warm_up_connections)
+
+    def _warm_up_thread(self, interval):
+        try:
+            self.ai_manager.warm_up()
+            self.ocr_manager.warm_up(interval)
+        except Exception as e:
+            logging.warning(f"预热连接失败: {e}", exc_info=True)
+
     def capture_and_recognize(self):
         self.status_var.set("正在截图...")
         self.update()
         threading.Thread(target=self._capture_and_recognize_thread, daemon=True).start()
 
 
-    def _format_question_text(self, text):
-        if not text:
-            return ""
-
-        lines = [line.strip() for line in text.splitlines() if line.strip()]
-        if not lines:
-            return ""
-
-        stop_words = {"确定", "取消", "确认", "返回", "完成", "提交", "关闭", "继续", "重试", "下一题", "上一题"}
-        while lines and (lines[-1] in stop_words or re.fullmatch(r"[0-9A-Za-z]+", lines[-1])):
-            lines.pop()
-        if not lines:
-            return ""
-
-        single_char_count = sum(1 for line in lines if len(line) <= 2)
-        if single_char_count >= max(1, int(len(lines) * 0.6)):
-            return ''.join(lines)
-
-        merged = []
-        buffer = []
-        for line in lines:
-            if len(line) <= 2 and not re.search(r"[。！？?！]", line):
-                buffer.append(line)
-            else:
-                if buffer:
-                    merged.append(''.join(buffer))
-                    buffer = []
-                merged.append(line)
-        if buffer:
-            merged.append(''.join(buffer))
-
-        return "\n".join(merged)
-
-
     def _capture_and_recognize_thread(self):
         try:
             image = self.screenshot_tool.capture_area()
@@ -339,7 +338,7 @@ class QuestionAssistant(ctk.CTk):
     def _ocr_thread(self, image):
         try:
             raw_text = self.ocr_manager.extract_text(image)
-            question_text = self._format_question_text(raw_text)
+            question_text = format_question_text(raw_text)
 
             # 记录识别到的题目
             logging.info(f"=" * 60)
@@ -351,42 +350,25 @@ class QuestionAssistant(ctk.CTk):
                 question_text = ""
             self.after(0, lambda: self.update_question_text(question_text))
             self.after(0, self.clear_ai_answers)
-            # 支持多种诗词问题格式
-            trigger_phrases = [
-                "请从以下字中选出一句诗词",
-                "请从下列字中选出一句诗词",
-                "从以下字中选出一句诗词",
-                "从下列字中选出一句诗词",
-                "用这些字组成一句诗",
-                "用下面的字组成诗句",
-                "这些字能组成什么诗句"
-            ]
-            is_poem_task = any(phrase in question_text for phrase in trigger_phrases)
+            # 诗词组字题提取候选字，其他题目为None
+            poem_chars = extract_poem_chars(question_text)
             self.after(0, lambda: self.status_var.set("正在获取AI及本地回答..."))
             self.after(0, lambda: self.header_status_label.configure(text="生成答案"))
-            self.get_all_answers_parallel(question_text, image, is_poem_task)
+            # 在界面线程中发起请求，保证排在上面的 clear_ai_answers 之后执行，不会取消新题目的请求
+            self.after(0, self.get_all_answers_parallel, question_text, image, poem_chars)
         except Exception as e:
             error_msg = str(e)
             logging.error(f"Error in OCR thread: {e}", exc_info=True)
             self.after(0, lambda: self.status_var.set(f"错误: {error_msg}"))
             self.after(0, lambda: messagebox.showerror("错误", f"处理过程中出现错误:\n{error_msg}"))
 
-    def get_all_answers_parallel(self, question_text, image, is_poem_task):
+    def get_all_answers_parallel(self, question_text, image, poem_chars=None):
         self.clear_ai_answers()
+        # poem_chars 为诗词组字题的候选字，其他题目为None
+        is_poem_task = poem_chars is not None
 
         if is_poem_task and hasattr(self, "local_results_frame"):
-            import re
-            chars_to_find = question_text
-
-            # 找到"诗词"的位置，提取其后的内容
-            if "诗词" in question_text:
-                idx = question_text.find("诗词")
-                chars_to_find = question_text[idx + 2:].strip()  # +2跳过"诗词"两个字
-
-            # 去除尾部的按钮文字（确定、取消等）
-            chars_to_find = re.sub(r'(确定|取消|选择|提交|重置).*$', '', chars_to_find)
-            chars_to_find = chars_to_find.strip()
-
+            chars_to_find = poem_chars
             logging.info(f"本地知识库 - 提取字符: {chars_to_find}")
 
             self.local_results_frame.configure(state="normal")
@@ -404,43 +386,25 @@ class QuestionAssistant(ctk.CTk):
             self.local_results_frame.insert("end", "本地匹配仅适用于诗词组字类题目。")
             self.local_results_frame.configure(state="disabled")
 
-        enabled_ais = self.ai_manager.get_enabled_ais()
-        ai_to_process = dict(list(enabled_ais.items())[:APP_CONFIG['MAX_AI_CONCURRENT']])
+        ai_to_process = self.ai_manager.get_enabled_ais()
 
         if not ai_to_process and not is_poem_task:
             self.after(0, lambda: self.status_var.set("未配置或启用任何服务"))
             self.after(0, lambda: messagebox.showwarning("警告", "请先在设置中启用至少一个AI服务"))
             return
 
-        def create_answer_card(name):
-            # 极简卡片：标题嵌入内容，1行高度
-            card = Card(self.answers_frame, theme=self.theme, padding=(8, 8))
-            card.pack(fill="x", expand=False, padx=6, pady=4)
-            card.content.grid_columnconfigure(0, weight=1)
-
-            body = InfoTextBox(
-                card.content,
-                fonts=self.fonts,
-                theme=self.theme,
-                height=24,  # 约1行文字高度
+        if ai_to_process:
+            # 抢答模式：第一个给出选项字母（组字题为诗句）的AI胜出，其余AI的回答立即取消
+            answer_parser = None
+            if self.ai_manager.race_mode:
+                answer_parser = lambda text, complete: parse_answer(text, poem_chars, complete)
+            # 所有AI在同一个后台事件循环中流式回答，增量按批交给界面线程；
+            # AI按首字耗时从快到慢排列，对冲模式下只请求最快的AI，备用请求按需发出，卡片在开始请求时创建
+            self._ai_run = self.ai_manager.ask_all(
+                ai_to_process, question_text, image,
+                on_events=lambda run, events: self.after(0, self._apply_ai_events, run, events),
+                answer_parser=answer_parser,
             )
-            body.grid(row=0, column=0, sticky="ew")
-
-            # 在文本框内添加标题前缀（标题颜色高亮）
-            body.insert("1.0", f"{name}：")
-            body.tag_add("ai_name", "1.0", f"1.{len(name)+1}")
-            body.tag_config("ai_name", foreground=self.theme.colors["accent"])
-
-            return body
-
-        for ai_name, config in ai_to_process.items():
-            body_widget = create_answer_card(ai_name)
-            self.answer_widgets[ai_name] = body_widget
-            threading.Thread(
-                target=self._get_single_ai_answer,
-                args=(ai_name, config, question_text, image, body_widget),
-                daemon=True
-            ).start()
 
     def _search_locally(self, query, widget):
         """普通搜索方法"""
@@ -488,7 +452,9 @@ class QuestionAssistant(ctk.CTk):
                 poems_info = []
                 for poem, matched_clauses in results:
                     poems_info.append(f"《{poem.get('title', '未知')}》- {poem.get('author', '未知')}: {matched_clauses}")
-                logging.info(f"本地知识库 - 找到结果: {'; '.join(poems_info)}")
+                partial_note = "（预览索引）" if getattr(results, "partial", False) else ""
+                fuzzy_note = "（形近字容错）" if getattr(results, "fuzzy", False) else ""
+                logging.info(f"本地知识库 - 找到结果{partial_note}{fuzzy_note}: {'; '.join(poems_info)}")
             else:
                 logging.info(f"本地知识库 - 未找到匹配")
 
@@ -518,6 +484,10 @@ class QuestionAssistant(ctk.CTk):
             widget.insert("end", "未找到匹配的诗词")
         else:
             widget.insert("end", "【答案】", "answer")
+            if getattr(answer, "partial", False):
+                widget.insert("end", "（完整索引构建中，结果可能不全）", "highlight")
+            if getattr(answer, "fuzzy", False):
+                widget.insert("end", "（题目疑似有字识别错误，按形近字匹配）", "highlight")
 
             # 首先显示所有匹配的诗句（答案）
             all_matched = []
@@ -553,42 +523,64 @@ class QuestionAssistant(ctk.CTk):
         self.after(100, lambda w=widget: self._adjust_widget_height(w))
 
 
-    def _get_single_ai_answer(self, ai_name, config, question_text, image, widget):
-        try:
-            logging.info(f"AI({ai_name}) - 开始请求")
-            stream = self.ai_manager.get_answer(ai_name, config, question_text, image)
-            buffer = []
-            for chunk in stream:
-                content = chunk.choices[0].delta.content or ""
-                if not content:
-                    continue
-                buffer.append(content)
-                self.after(0, widget.insert, "end", content)
-                if not self.highlight_populated:
-                    preview = "".join(buffer)
-                    if preview.strip():
-                        self.after(0, lambda text=preview: self._update_highlight_preview(ai_name, text))
-
-            # 记录完整的AI回答
-            full_answer = "".join(buffer)
-            if full_answer.strip():
-                # 限制日志长度，只记录前500字符
-                log_answer = full_answer[:500] + "..." if len(full_answer) > 500 else full_answer
-                logging.info(f"AI({ai_name}) - 回答: {log_answer}")
-            else:
-                logging.warning(f"AI({ai_name}) - 回答为空")
-
-            self.after(100, lambda w=widget: self._adjust_widget_height(w))
-            self.after(0, lambda: self.header_status_label.configure(text="完成"))
-            if not self.highlight_populated:
-                joined = "".join(buffer)
-                if joined.strip():
-                    self.after(0, lambda text=joined: self._update_highlight_preview(ai_name, text))
-        except Exception as e:
-            error_msg = f"获取{ai_name}回答时出错: {str(e)}"
-            logging.error(f"AI({ai_name})错误: {e}", exc_info=True)
-            self.after(0, widget.insert, "end", error_msg)
-            self.after(0, lambda: self.header_status_label.configure(text="服务异常"))
+    def _create_answer_card(self, name):
+        # 极简卡片：标题嵌入内容，1行高度
+        card = Card(self.answers_frame, theme=self.theme, padding=(8, 8))
+        card.pack(fill="x", expand=False, padx=6, pady=4)
+        card.content.grid_columnconfigure(0, weight=1)
+
+        body = InfoTextBox(
+            card.content,
+            fonts=self.fonts,
+            theme=self.theme,
+            height=24,  # 约1行文字高度
+        )
+        body.grid(row=0, column=0, sticky="ew")
+
+        # 在文本框内添加标题前缀（标题颜色高亮）
+        body.insert("1.0", f"{name}：")
+        body.tag_add("ai_name", "1.0", f"1.{len(name)+1}")
+        body.tag_config("ai_name", foreground=self.theme.colors["accent"])
+
+        return body
+
+    def _apply_ai_events(self, run, events):
+        """在界面线程中显示一批AI回答事件，已被新题目取代的请求的事件直接丢弃"""
+        if run is not self._ai_run:
+            return
+        for ai_name, kind, text in events:
+            if kind == "started":
+                widget = self._create_answer_card(ai_name)
+                self.answer_widgets[ai_name] = widget
+                self.answer_texts[ai_name] = ""
+                if text == "hedge":
+                    widget.insert(f"1.{len(ai_name) + 1}", "【备用】", "ai_name")
+                continue
+            widget = self.answer_widgets.get(ai_name)
+            if widget is None:
+                continue
+            if kind == "delta":
+                widget.insert("end", text)
+                self.answer_texts[ai_name] = self.answer_texts.get(ai_name, "") + text
+                if not self.highlight_populated and self.answer_texts[ai_name].strip():
+                    self._update_highlight_preview(ai_name, self.answer_texts[ai_name])
+            elif kind == "done":
+                self._adjust_widget_height(widget)
+                self.header_status_label.configure(text="完成")
+                if not self.highlight_populated and text.strip():
+                    self._update_highlight_preview(ai_name, text)
+            elif kind == "error":
+                widget.insert("end", f"获取{ai_name}回答时出错: {text}")
+                self.header_status_label.configure(text="服务异常")
+            elif kind == "won":
+                # 在卡片标题后标出抢答胜出和首字耗时
+                badge = f"【抢答 {run.ttft[ai_name]:.2f}秒】"
+                widget.insert(f"1.{len(ai_name) + 1}", badge, "ai_name")
+                self.status_var.set(f"{ai_name} 抢答：{text}（首字 {run.ttft[ai_name]:.2f} 秒）")
+                self.header_status_label.configure(text="抢答完成")
+            elif kind == "cancelled":
+                widget.insert("end", "（较慢，已取消）")
+                self._adjust_widget_height(widget)
 
     def _adjust_widget_height(self, widget):
         # Adjust height of the textbox to fit its content
@@ -605,9 +597,13 @@ class QuestionAssistant(ctk.CTk):
 
 
     def clear_ai_answers(self):
+        if self._ai_run is not None:
+            self._ai_run.cancel()
+            self._ai_run = None
         for widget in self.answers_frame.winfo_children():
             widget.destroy()
         self.answer_widgets = {}
+        self.answer_texts = {}
         self.highlight_populated = False
         if hasattr(self, "local_results_frame"):
             self.local_results_frame.configure(state="normal")
@@ -667,7 +663,12 @@ class QuestionAssistant(ctk.CTk):
             self.progress_bar.stop()
         except Exception:
             pass
+        if self._warm_up_job is not None:
+            self.after_cancel(self._warm_up_job)
+            self._warm_up_job = None
         self.screenshot_tool.cleanup()
+        self.ai_manager.close()
+        self.ocr_manager.close()
         release = getattr(self.kb_manager, "release", None)
         if callable(release):
             release()
@@ -727,5 +728,7 @@ class QuestionAssistant(ctk.CTk):
         self.mainloop()
 
 if __name__ == "__main__":
+    # 打包为exe后，索引构建的子进程需要由此进入
+    multiprocessing.freeze_support()
     app = QuestionAssistant()
     app.run()
@@ -9,6 +9,9 @@ import time
 import logging
 
 class OCRManager:
+    # 百度云OCR接口所在主机，预热时与其建立连接
+    BAIDU_HOST = "https://aip.baidubce.com"
+
     def __init__(self):
         self.settings = {
             "type": "tesseract", #可以是 "tesseract", "baidu"
@@ -20,6 +23,9 @@ class OCRManager:
         self.load_settings({})
         self.baidu_access_token = None
         self.baidu_token_expire_time = 0
+        # 复用与百度云的HTTPS连接，获取令牌和识别请求共用
+        self.session = requests.Session()
+        self._last_warm_up = float("-inf")
         self.preload_ocr_engine()
         
     def load_settings(self, settings):
@@ -62,6 +68,33 @@ class OCRManager:
             except Exception:
                 pass
     
+    def warm_up(self, max_age):
+        """
+        预热百度云OCR连接：令牌过期时顺带获取令牌，否则发送一次HEAD请求建立连接
+        :param max_age: 距上次预热不足该秒数时跳过
+        """
+        if self.settings.get("type") != "baidu" or not self.settings.get("baidu_api_key"):
+            return
+        start = time.monotonic()
+        if start - self._last_warm_up < max_age:
+            return
+        # 先登记预热时间，避免重复触发时同时预热；失败时撤销
+        last_warm_up, self._last_warm_up = self._last_warm_up, start
+        try:
+            if self.baidu_access_token and self.baidu_token_expire_time > time.time():
+                self.session.head(self.BAIDU_HOST, timeout=5)
+            else:
+                self._get_baidu_access_token(retries=1)
+        except Exception as e:
+            self._last_warm_up = last_warm_up
+            logging.info(f"预热百度云OCR连接失败: {e}")
+            return
+        logging.info(f"已预热百度云OCR连接，耗时 {time.monotonic() - start:.2f} 秒")
+
+    def close(self):
+        """关闭与OCR服务的连接"""
+        self.session.close()
+
     def _extract_text_tesseract(self, image: Image.Image) -> str:
         """
         使用Tesseract从图片中提取文字
@@ -97,7 +130,7 @@ class OCRManager:
         
         for i in range(retries):
             try:
-                response = requests.post(url, timeout=10)
+                response = self.session.post(url, timeout=10)
                 response.raise_for_status()
                 result = response.json()
                 
@@ -138,7 +171,7 @@ class OCRManager:
         }
         
         try:
-            response = requests.post(url, headers=headers, data=data, timeout=30)
+            response = self.session.post(url, headers=headers, data=data, timeout=30)
             response.raise_for_status()
             result = response.json()
             
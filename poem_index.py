@@ -0,0 +1,340 @@
+import zlib
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+
+
+def char_bit(char):
+    """字符在64位诗句位掩码中对应的位（乘法散列，使相邻码位分散到不同位上）"""
+    return 1 << (((ord(char) * 2654435761) >> 16) & 63)
+
+
+def chars_mask(text):
+    """计算一段文本的字符位掩码"""
+    mask = 0
+    for char in text:
+        mask |= char_bit(char)
+    return mask
+
+
+def signature_of(text):
+    """诗句签名：排序后的字符，字符多重集相同的诗句签名相同"""
+    return ''.join(sorted(text))
+
+
+def signature_hash(signature):
+    """签名的64位散列（跨进程稳定，可写入磁盘）"""
+    data = signature.encode('utf-32-le')
+    return (zlib.crc32(data) << 32) | zlib.adler32(data)
+
+
+class ClauseTable:
+    """
+    列式诗句表：所有诗句拼接为一段连续文本，
+    第 i 句为 text[offsets[i]:offsets[i + 1]]，poem_ids[i] 为所属诗词下标；
+    joins_next[i] 为1表示第 i + 1 句在原诗同一行中紧接第 i 句，两句连写即 text[offsets[i]:offsets[i + 2]]
+    """
+
+    def __init__(self, text='', normalized='', offsets=None, poem_ids=None, masks=None, joins_next=None):
+        self.text = text
+        # 归一化只做逐字替换、不改变长度，因此与原文共用偏移数组；无替换时直接复用原文对象
+        self.normalized = normalized
+        self.offsets = offsets if offsets is not None else array('I', [0])
+        self.poem_ids = poem_ids if poem_ids is not None else array('I')
+        # 每个诗句的64位字符位掩码，用于在精确计数前快速排除候选
+        self.masks = masks if masks is not None else array('Q')
+        self.joins_next = joins_next if joins_next is not None else bytearray()
+
+    def __len__(self):
+        return len(self.poem_ids)
+
+    def clause(self, clause_id):
+        """诗句原文"""
+        return self.text[self.offsets[clause_id]:self.offsets[clause_id + 1]]
+
+    def normalized_clause(self, clause_id):
+        """归一化后的诗句"""
+        return self.normalized[self.offsets[clause_id]:self.offsets[clause_id + 1]]
+
+    def normalized_span(self, clause_id, count):
+        """从 clause_id 开始连续 count 句归一化诗句的连写"""
+        return self.normalized[self.offsets[clause_id]:self.offsets[clause_id + count]]
+
+    def nbytes(self):
+        """估算占用的内存字节数"""
+        size = _str_nbytes(self.text)
+        if self.normalized is not self.text:
+            size += _str_nbytes(self.normalized)
+        for column in (self.offsets, self.poem_ids, self.masks):
+            size += column.itemsize * len(column)
+        return size + len(self.joins_next)
+
+
+class ClauseIndex:
+    """
+    诗句索引：列式诗句表 + 字符倒排表 + 锚点倒排表 + 字谜签名表（单句、相邻两句连写）
+    倒排表只保存升序的整数诗句ID；签名表按64位散列排序，查找时二分定位后再核对签名；
+    两句连写直接引用诗句表中的连续文本，不额外保存字符串
+    """
+
+    def __init__(self, table=None, postings=None, sig_hashes=None, sig_clause_ids=None, anchors=None,
+                 pair_sig_hashes=None, pair_sig_clause_ids=None, length_stats=None):
+        self.table = table if table is not None else ClauseTable()
+        # {字符: array('I', [诗句ID升序])}
+        self.postings = postings if postings is not None else {}
+        self.sig_hashes = sig_hashes if sig_hashes is not None else array('Q')
+        self.sig_clause_ids = sig_clause_ids if sig_clause_ids is not None else array('I')
+        # {字符: array('I', [诗句ID升序])}，每个诗句只登记在它全局最少见的字符下，
+        # 因此任何能由题目组成的诗句都恰好出现在题目某个字的锚点倒排表中一次
+        self.anchors = anchors if anchors is not None else {}
+        # 两句连写的签名表，诗句ID为前一句的ID
+        self.pair_sig_hashes = pair_sig_hashes if pair_sig_hashes is not None else array('Q')
+        self.pair_sig_clause_ids = pair_sig_clause_ids if pair_sig_clause_ids is not None else array('I')
+        # {诗句长度: [诗句数, 倒排表条目数]}
+        self.length_stats = length_stats if length_stats is not None else {}
+
+    def __len__(self):
+        return len(self.table)
+
+    def posting(self, char):
+        """字符的倒排表，字符不在索引中时返回空元组"""
+        return self.postings.get(char, ())
+
+    def anchor_posting(self, char):
+        """以该字符为锚点的诗句，字符不是任何诗句的锚点时返回空元组"""
+        return self.anchors.get(char, ())
+
+    def signature_count(self, signature):
+        """字符多重集与签名相同的诗句数量（按散列统计，仅用于排序）"""
+        sig_hash = signature_hash(signature)
+        return bisect_right(self.sig_hashes, sig_hash) - bisect_left(self.sig_hashes, sig_hash)
+
+    def lookup_signature(self, signature):
+        """
+        查找字符多重集与签名完全相同的诗句
+        :return: 诗句ID列表
+        """
+        return self._lookup(self.sig_hashes, self.sig_clause_ids, signature, 1)
+
+    def lookup_pair_signature(self, signature):
+        """
+        查找字符多重集与签名完全相同的相邻两句
+        :return: 前一句的诗句ID列表
+        """
+        return self._lookup(self.pair_sig_hashes, self.pair_sig_clause_ids, signature, 2)
+
+    def _lookup(self, sig_hashes, sig_clause_ids, signature, span):
+        sig_hash = signature_hash(signature)
+        pos = bisect_left(sig_hashes, sig_hash)
+        hits = []
+        while pos < len(sig_hashes) and sig_hashes[pos] == sig_hash:
+            clause_id = sig_clause_ids[pos]
+            # 散列可能碰撞，核对真实签名
+            if signature_of(self.table.normalized_span(clause_id, span)) == signature:
+                hits.append(clause_id)
+            pos += 1
+        return hits
+
+    def nbytes(self):
+        """估算索引各部分占用的内存字节数"""
+        postings = sum(p.itemsize * len(p) for p in self.postings.values())
+        postings += sum(p.itemsize * len(p) for p in self.anchors.values())
+        signatures = sum(
+            column.itemsize * len(column)
+            for column in (self.sig_hashes, self.sig_clause_ids, self.pair_sig_hashes, self.pair_sig_clause_ids)
+        )
+        return {
+            'clauses': self.table.nbytes(),
+            'postings': postings,
+            'signatures': signatures,
+        }
+
+
+class ClauseIndexBuilder:
+    """逐句追加诗句并生成 ClauseIndex"""
+
+    def __init__(self, pair_signatures=True):
+        """
+        :param pair_signatures: 是否为相邻两句的连写建立签名
+        """
+        self.pair_signatures = pair_signatures
+        self._texts = []
+        self._normalized = []
+        self._offsets = array('I', [0])
+        self._poem_ids = array('I')
+        self._masks = array('Q')
+        self._sig_hashes = array('Q')
+        self._joins_next = bytearray()
+        self._pair_sig_hashes = array('Q')
+        self._pair_clause_ids = array('I')
+        self._length_stats = {}
+        # 诗句ID按追加顺序递增，因此每个倒排表天然有序
+        self._postings = defaultdict(lambda: array('I'))
+
+    def __len__(self):
+        return len(self._poem_ids)
+
+    def add(self, poem_idx, clause, normalized_clause, joins_previous=False):
+        """
+        追加一个诗句，normalized_clause 必须与 clause 等长
+        :param joins_previous: 该句在原诗同一行中紧接上一次追加的诗句
+        """
+        clause_id = len(self._poem_ids)
+        self._joins_next.append(0)
+        if joins_previous and clause_id:
+            self._joins_next[clause_id - 1] = 1
+            if self.pair_signatures:
+                self._pair_sig_hashes.append(signature_hash(signature_of(self._normalized[-1] + normalized_clause)))
+                self._pair_clause_ids.append(clause_id - 1)
+        self._texts.append(clause)
+        self._normalized.append(normalized_clause)
+        self._offsets.append(self._offsets[-1] + len(clause))
+        self._poem_ids.append(poem_idx)
+        self._masks.append(chars_mask(normalized_clause))
+        self._sig_hashes.append(signature_hash(signature_of(normalized_clause)))
+
+        # 为诗句中的每个字符建立索引
+        distinct_chars = set(normalized_clause)
+        for char in distinct_chars:
+            self._postings[char].append(clause_id)
+
+        stats = self._length_stats.setdefault(len(clause), [0, 0])
+        stats[0] += 1
+        stats[1] += len(distinct_chars)
+        return clause_id
+
+    def parts(self):
+        """
+        导出构建中间结果（可跨进程传递），用 merge_parts 合并为完整索引
+        :return: ClauseIndexParts
+        """
+        return ClauseIndexParts(
+            text=''.join(self._texts),
+            normalized=''.join(self._normalized),
+            offsets=self._offsets,
+            poem_ids=self._poem_ids,
+            masks=self._masks,
+            sig_hashes=self._sig_hashes,
+            postings=dict(self._postings),
+            joins_next=self._joins_next,
+            pair_sig_hashes=self._pair_sig_hashes,
+            pair_clause_ids=self._pair_clause_ids,
+            length_stats=self._length_stats,
+        )
+
+    def build(self):
+        """生成只读的 ClauseIndex"""
+        return merge_parts([self.parts()])
+
+
+class ClauseIndexParts:
+    """一个分片的构建结果：诗句ID从0开始，签名散列未排序"""
+
+    def __init__(self, text, normalized, offsets, poem_ids, masks, sig_hashes, postings,
+                 joins_next, pair_sig_hashes, pair_clause_ids, length_stats):
+        self.text = text
+        self.normalized = normalized
+        self.offsets = offsets
+        self.poem_ids = poem_ids
+        self.masks = masks
+        self.sig_hashes = sig_hashes
+        self.postings = postings
+        self.joins_next = joins_next
+        self.pair_sig_hashes = pair_sig_hashes
+        self.pair_clause_ids = pair_clause_ids
+        self.length_stats = length_stats
+
+    def __len__(self):
+        return len(self.poem_ids)
+
+
+def merge_parts(parts_list):
+    """
+    按顺序合并多个分片为一个 ClauseIndex：诗句ID与文本偏移依次平移，
+    倒排表首尾相接后仍保持升序
+    """
+    text = ''.join(parts.text for parts in parts_list)
+    normalized = ''.join(parts.normalized for parts in parts_list)
+    if normalized == text:
+        normalized = text
+
+    offsets = array('I', [0])
+    poem_ids = array('I')
+    masks = array('Q')
+    sig_hashes = array('Q')
+    joins_next = bytearray()
+    pair_sig_hashes = array('Q')
+    pair_clause_ids = array('I')
+    length_stats = {}
+    postings = {}
+    clause_base = 0
+    text_base = 0
+
+    for parts in parts_list:
+        if clause_base == 0:
+            offsets.extend(parts.offsets[1:])
+        else:
+            offsets.extend(map(text_base.__add__, parts.offsets[1:]))
+        poem_ids.extend(parts.poem_ids)
+        masks.extend(parts.masks)
+        sig_hashes.extend(parts.sig_hashes)
+        # 分片按诗词切分，相邻两句不会跨分片
+        joins_next.extend(parts.joins_next)
+        pair_sig_hashes.extend(parts.pair_sig_hashes)
+        pair_clause_ids.extend(map(clause_base.__add__, parts.pair_clause_ids))
+        for length, (clause_count, posting_count) in parts.length_stats.items():
+            stats = length_stats.setdefault(length, [0, 0])
+            stats[0] += clause_count
+            stats[1] += posting_count
+
+        for char, posting in parts.postings.items():
+            if clause_base:
+                posting = array('I', map(clause_base.__add__, posting))
+            merged = postings.get(char)
+            if merged is None:
+                postings[char] = array('I', posting)
+            else:
+                merged.extend(posting)
+
+        clause_base += len(parts)
+        text_base = offsets[-1]
+
+    table = ClauseTable(text, normalized, offsets, poem_ids, masks, joins_next)
+
+    order = sorted(range(len(sig_hashes)), key=sig_hashes.__getitem__)
+    sorted_hashes = array('Q', (sig_hashes[i] for i in order))
+    sig_clause_ids = array('I', order)
+
+    pair_order = sorted(range(len(pair_sig_hashes)), key=pair_sig_hashes.__getitem__)
+    sorted_pair_hashes = array('Q', (pair_sig_hashes[i] for i in pair_order))
+    pair_sig_clause_ids = array('I', (pair_clause_ids[i] for i in pair_order))
+
+    return ClauseIndex(
+        table, postings, sorted_hashes, sig_clause_ids, build_anchors(postings, len(table)),
+        sorted_pair_hashes, pair_sig_clause_ids, dict(sorted(length_stats.items())),
+    )
+
+
+def build_anchors(postings, clause_count):
+    """
+    生成锚点倒排表：按倒排表从短到长依次处理字符，尚未登记的诗句归入当前字符，
+    每个诗句最终只登记在它最少见的字符下，各锚点倒排表总长度等于诗句数
+    """
+    assigned = bytearray(clause_count)
+    anchors = {}
+    for char in sorted(postings, key=lambda c: (len(postings[c]), c)):
+        posting = array('I', [clause_id for clause_id in postings[char] if not assigned[clause_id]])
+        if posting:
+            for clause_id in posting:
+                assigned[clause_id] = 1
+            anchors[char] = posting
+    return anchors
+
+
+def _str_nbytes(text):
+    """字符串内容占用的字节数（按CPython紧凑表示估算）"""
+    if not text:
+        return 0
+    max_code = ord(max(text))
+    width = 1 if max_code < 0x100 else 2 if max_code < 0x10000 else 4
+    return width * len(text)
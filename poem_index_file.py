@@ -0,0 +1,237 @@
+import sys
+import json
+import mmap
+import struct
+from array import array
+from bisect import bisect_left
+
+from poem_index import ClauseIndex, ClauseTable
+
+# 文件头：魔数 + 头部JSON长度，随后是头部JSON和按8字节对齐的各数据段
+_MAGIC = b'PIDX'
+_PREFIX = struct.Struct('<4sI')
+_ALIGN = 8
+
+# 索引文件格式版本号，数据段布局变化时递增
+FORMAT_VERSION = 1
+
+
+def _aligned(size):
+    return (size + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+def _directory(postings):
+    """将 {字符: 诗句ID数组} 展开为 (字符码位, 起始位置, 诗句ID) 三个定长数组"""
+    codes = array('I')
+    starts = array('I', [0])
+    ids = array('I')
+    for char in sorted(postings):
+        codes.append(ord(char))
+        ids.extend(postings[char])
+        starts.append(len(ids))
+    return codes, starts, ids
+
+
+def write_index_file(index, path, key, meta=None, row_ids=None):
+    """
+    将 ClauseIndex 写为可直接内存映射的二进制文件：定长数组 + UTF-32 文本段，加载时无需反序列化
+    :param key: 校验键，与 load_index_file 传入的不一致时视为失效
+    :param meta: 随索引保存的附加信息（可JSON序列化），加载时原样返回
+    :param row_ids: 诗词下标到数据库行ID的映射 array('q')
+    """
+    table = index.table
+    sections = [
+        ('text', 'B', table.text.encode('utf-32-le')),
+        ('offsets', 'I', table.offsets),
+        ('poem_ids', 'I', table.poem_ids),
+        ('masks', 'Q', table.masks),
+        ('joins_next', 'B', bytes(table.joins_next)),
+        ('sig_hashes', 'Q', index.sig_hashes),
+        ('sig_clause_ids', 'I', index.sig_clause_ids),
+        ('pair_sig_hashes', 'Q', index.pair_sig_hashes),
+        ('pair_sig_clause_ids', 'I', index.pair_sig_clause_ids),
+    ]
+    # 归一化文本与原文相同时不重复保存
+    normalized_shared = table.normalized is table.text or table.normalized == table.text
+    if not normalized_shared:
+        sections.append(('normalized', 'B', table.normalized.encode('utf-32-le')))
+    if row_ids is not None:
+        sections.append(('row_ids', 'q', array('q', row_ids)))
+    for name, postings in (('postings', index.postings), ('anchors', index.anchors)):
+        codes, starts, ids = _directory(postings)
+        sections += [(f'{name}_chars', 'I', codes), (f'{name}_starts', 'I', starts), (f'{name}_ids', 'I', ids)]
+
+    layout = {}
+    blobs = []
+    position = 0
+    for name, typecode, data in sections:
+        blob = data.tobytes() if isinstance(data, array) else data
+        layout[name] = [position, typecode, len(blob)]
+        blobs.append(blob)
+        position = _aligned(position + len(blob))
+
+    header = json.dumps({
+        'format': FORMAT_VERSION,
+        'byteorder': sys.byteorder,
+        'itemsizes': {code: array(code).itemsize for code in 'IQq'},
+        'key': key,
+        'meta': meta,
+        'normalized_shared': normalized_shared,
+        'length_stats': {str(length): stats for length, stats in index.length_stats.items()},
+        'sections': layout,
+    }, ensure_ascii=False).encode('utf-8')
+
+    data_start = _aligned(_PREFIX.size + len(header))
+    with open(path, 'wb') as f:
+        f.write(_PREFIX.pack(_MAGIC, len(header)))
+        f.write(header)
+        f.write(b'\0' * (data_start - _PREFIX.size - len(header)))
+        written = 0
+        for blob in blobs:
+            f.write(blob)
+            written += len(blob)
+            padding = _aligned(written) - written
+            f.write(b'\0' * padding)
+            written += padding
+
+
+def load_index_file(path, key):
+    """
+    以只读内存映射方式打开索引文件，各数组直接在映射上查询，多个进程共享页缓存
+    :return: (ClauseIndex, meta, row_ids, IndexMapping)，未保存 row_ids 时其为None；
+             文件与校验键或当前平台不匹配时返回None；文件损坏时抛出异常
+    """
+    with open(path, 'rb') as f:
+        magic, header_len = _PREFIX.unpack(f.read(_PREFIX.size))
+        if magic != _MAGIC:
+            raise ValueError("不是诗句索引文件")
+        header = json.loads(f.read(header_len).decode('utf-8'))
+        if (header.get('format') != FORMAT_VERSION
+                or header.get('byteorder') != sys.byteorder
+                or header.get('itemsizes') != {code: array(code).itemsize for code in 'IQq'}
+                or header.get('key') != json.loads(json.dumps(key, ensure_ascii=False))):
+            return None
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    mapping = IndexMapping(mapped)
+    view = mapping.track(memoryview(mapped))
+    data_start = _aligned(_PREFIX.size + header_len)
+
+    def section(name):
+        offset, typecode, size = header['sections'][name]
+        start = data_start + offset
+        if start + size > len(view):
+            mapping.close()
+            raise ValueError(f"索引文件不完整: {name}")
+        return mapping.track(view[start:start + size].cast(typecode))
+
+    text = section('text')
+    normalized = text if header['normalized_shared'] else section('normalized')
+    table = MappedClauseTable(
+        text, normalized, section('offsets'), section('poem_ids'), section('masks'), section('joins_next'),
+    )
+    postings, anchors = (
+        _MappedPostings(section(f'{name}_chars'), section(f'{name}_starts'), section(f'{name}_ids'))
+        for name in ('postings', 'anchors')
+    )
+    index = ClauseIndex(
+        table, postings, section('sig_hashes'), section('sig_clause_ids'), anchors,
+        section('pair_sig_hashes'), section('pair_sig_clause_ids'),
+        {int(length): stats for length, stats in header['length_stats'].items()},
+    )
+    row_ids = section('row_ids') if 'row_ids' in header['sections'] else None
+    return index, header.get('meta'), row_ids, mapping
+
+
+class IndexMapping:
+    """
+    索引文件的内存映射及建立在其上的各数组视图；
+    Windows 上映射未关闭时文件无法被替换或删除，重写索引文件前须调用 close()
+    """
+
+    def __init__(self, mapped):
+        self._mmap = mapped
+        self._views = []
+
+    def track(self, view):
+        self._views.append(view)
+        return view
+
+    def close(self):
+        """
+        释放所有视图并关闭映射，之后映射上的索引不可再查询
+        :return: 映射是否已关闭（仍有外部持有的切片时为False，映射在切片被回收后释放）
+        """
+        if self._mmap is None:
+            return True
+        for view in reversed(self._views):
+            view.release()
+        self._views.clear()
+        try:
+            self._mmap.close()
+        except BufferError:
+            return False
+        self._mmap = None
+        return True
+
+
+class MappedClauseTable(ClauseTable):
+    """映射在文件上的诗句表：文本为UTF-32编码的字节段，读取诗句时按偏移解码"""
+
+    def clause(self, clause_id):
+        return str(self.text[self.offsets[clause_id] * 4:self.offsets[clause_id + 1] * 4], 'utf-32-le')
+
+    def normalized_clause(self, clause_id):
+        return str(self.normalized[self.offsets[clause_id] * 4:self.offsets[clause_id + 1] * 4], 'utf-32-le')
+
+    def normalized_span(self, clause_id, count):
+        return str(
+            self.normalized[self.offsets[clause_id] * 4:self.offsets[clause_id + count] * 4], 'utf-32-le'
+        )
+
+    def nbytes(self):
+        """映射的字节数（由系统页缓存按需载入，不占用Python堆内存）"""
+        size = len(self.text)
+        if self.normalized is not self.text:
+            size += len(self.normalized)
+        for column in (self.offsets, self.poem_ids, self.masks, self.joins_next):
+            size += column.nbytes
+        return size
+
+
+class _MappedPostings:
+    """映射在文件上的倒排表目录，提供 ClauseIndex 所需的只读字典接口"""
+
+    def __init__(self, codes, starts, ids):
+        self._codes = codes
+        self._starts = starts
+        self._ids = ids
+
+    def __len__(self):
+        return len(self._codes)
+
+    def __iter__(self):
+        return map(chr, self._codes)
+
+    def __contains__(self, char):
+        return self._find(char) >= 0
+
+    def _find(self, char):
+        code = ord(char)
+        pos = bisect_left(self._codes, code)
+        if pos < len(self._codes) and self._codes[pos] == code:
+            return pos
+        return -1
+
+    def get(self, char, default=None):
+        pos = self._find(char)
+        if pos < 0:
+            return default
+        return self._ids[self._starts[pos]:self._starts[pos + 1]]
+
+    def values(self):
+        starts = self._starts
+        return (self._ids[starts[pos]:starts[pos + 1]] for pos in range(len(self._codes)))
+
+    def items(self):
+        return zip(self, self.values())
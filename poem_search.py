@@ -0,0 +1,157 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+
+
+def _spaced(text):
+    """将文本拆成逐字空格分隔的形式，使FTS5按单字建索引"""
+    return ' '.join(ch for ch in text if not ch.isspace())
+
+
+def _phrase_query(query):
+    """将搜索词转换为FTS5短语查询：逐字相邻匹配，等价于子串匹配"""
+    chars = [ch for ch in query if not ch.isspace()]
+    if not chars:
+        return None
+    return '"' + ' '.join(chars).replace('"', '""') + '"'
+
+
+class PoemSearchIndex:
+    """
+    基于SQLite FTS5的诗词全文检索旁路库
+    中文没有分词边界，因此逐字建索引、用短语查询匹配连续字串，
+    任意长度（包括单字、双字）的搜索词都能走索引，并按bm25排序
+    """
+
+    # 旁路库格式版本号，表结构变化时递增
+    FORMAT_VERSION = 1
+    # bm25列权重：标题 > 作者 > 正文
+    _BM25_WEIGHTS = (10.0, 5.0, 1.0)
+    # 构建时每批写入的行数
+    _BUILD_BATCH_SIZE = 5000
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def is_supported():
+        """当前SQLite是否编译了FTS5"""
+        try:
+            conn = sqlite3.connect(':memory:')
+            try:
+                conn.execute("CREATE VIRTUAL TABLE t USING fts5(a)")
+            finally:
+                conn.close()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def is_valid(self, key):
+        """旁路库存在且与给定校验键一致"""
+        if not os.path.exists(self.path):
+            return False
+        try:
+            conn = sqlite3.connect(self.path)
+            try:
+                row = conn.execute("SELECT value FROM meta WHERE key = 'key'").fetchone()
+            finally:
+                conn.close()
+            return row is not None and json.loads(row[0]) == self._full_key(key)
+        except (sqlite3.Error, ValueError):
+            return False
+
+    def build(self, indexed_poems, key):
+        """
+        构建全文索引（先写临时文件再替换，避免半写入）
+        :param indexed_poems: (poem_idx, poem) 迭代器
+        :param key: 校验键，数据源变化后 is_valid 返回False
+        """
+        start_time = time.perf_counter()
+        tmp_path = self.path + '.tmp'
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+        conn = sqlite3.connect(tmp_path)
+        try:
+            conn.execute("PRAGMA journal_mode = OFF")
+            conn.execute("PRAGMA synchronous = OFF")
+            conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+            # 无内容表：只保存倒排索引，诗词正文仍从原数据源读取
+            conn.execute(
+                "CREATE VIRTUAL TABLE poems_fts USING fts5(title, author, content, content='')"
+            )
+
+            batch = []
+            count = 0
+            for poem_idx, poem in indexed_poems:
+                if not poem:
+                    continue
+                content = poem.get('content', [])
+                if isinstance(content, list):
+                    content = ''.join(content)
+                batch.append((
+                    poem_idx,
+                    _spaced(str(poem.get('title', ''))),
+                    _spaced(str(poem.get('author', ''))),
+                    _spaced(str(content)),
+                ))
+                if len(batch) >= self._BUILD_BATCH_SIZE:
+                    conn.executemany(
+                        "INSERT INTO poems_fts (rowid, title, author, content) VALUES (?, ?, ?, ?)", batch
+                    )
+                    count += len(batch)
+                    batch = []
+            if batch:
+                conn.executemany(
+                    "INSERT INTO poems_fts (rowid, title, author, content) VALUES (?, ?, ?, ?)", batch
+                )
+                count += len(batch)
+
+            conn.execute("INSERT INTO poems_fts (poems_fts) VALUES ('optimize')")
+            conn.execute(
+                "INSERT INTO meta (key, value) VALUES ('key', ?)",
+                (json.dumps(self._full_key(key), ensure_ascii=False),),
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+        self.close()
+        os.replace(tmp_path, self.path)
+
+        elapsed = time.perf_counter() - start_time
+        size_mb = os.path.getsize(self.path) / 1024 / 1024
+        logging.info(f"全文检索索引构建完成，共 {count} 首，{size_mb:.1f}MB，耗时 {elapsed:.2f} 秒")
+
+    def search(self, query, limit=50, offset=0):
+        """
+        按相关度搜索
+        :return: 诗词下标列表（按bm25排序）
+        """
+        match = _phrase_query(query)
+        if match is None:
+            return []
+
+        with self._lock:
+            if self._conn is None:
+                self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            rows = self._conn.execute(
+                "SELECT rowid FROM poems_fts WHERE poems_fts MATCH ? "
+                "ORDER BY bm25(poems_fts, ?, ?, ?) LIMIT ? OFFSET ?",
+                (match, *self._BM25_WEIGHTS, limit, offset),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def _full_key(self, key):
+        return {'format': self.FORMAT_VERSION, **key}
@@ -0,0 +1,136 @@
+"""
+题目解析：整理OCR识别的题目文本，识别诗词组字题并提取题目给出的候选字
+所有正则在模块加载时编译一次，解析过程只做单遍扫描
+"""
+import re
+
+# 诗词组字题的触发短语（OCR可能在字间插入空白或换行）
+TRIGGER_PHRASES = (
+    "请从以下字中选出一句诗词",
+    "请从下列字中选出一句诗词",
+    "从以下字中选出一句诗词",
+    "从下列字中选出一句诗词",
+    "字中选出一句诗词",
+    "用这些字组成一句诗",
+    "用下面的字组成诗句",
+    "这些字能组成什么诗句",
+    "组成一句诗",
+    "组成诗句",
+)
+
+# 题目区域下方的按钮文字
+BUTTON_WORDS = frozenset({
+    "确定", "取消", "确认", "返回", "完成", "提交", "关闭", "继续", "重试", "下一题", "上一题", "选择", "重置",
+})
+
+# 候选字少于该数量时，认为候选字排在触发短语之前（字格在题干上方的布局）
+MIN_GRID_CHARS = 4
+
+_WHITESPACE = re.compile(r"\s+")
+_ALNUM_LINE = re.compile(r"[0-9A-Za-z]+")
+_SENTENCE_END = re.compile(r"[。！？?！]")
+_BUTTONS = "(?:" + "|".join(sorted(map(re.escape, BUTTON_WORDS), key=len, reverse=True)) + ")"
+# 以按钮结尾的行：整行都是按钮，或按钮与最后一行字粘连（OCR常识别为同一行），按钮之后都属于界面
+_BUTTON_LINE_END = re.compile(_BUTTONS + r"(?:[ \t]*" + _BUTTONS + r")*[ \t]*$", re.M)
+# 字格中的界面噪声：以空白分隔的按钮、括号内的提示、题号、分数、计时
+_GRID_NOISE = re.compile(
+    r"(?<!\S)" + _BUTTONS + r"(?!\S)"
+    r"|[（(][^）)]*[）)]"
+    r"|第\s*[0-9一二三四五六七八九十]+\s*题|共\s*[0-9一二三四五六七八九十]+\s*题"
+    r"|[0-9]+\s*分|剩余时间|倒计时|得分|积分"
+)
+# 中日韩统一表意文字（含扩展A区和兼容区）以外的字符
+_NON_HAN = re.compile(r"[^\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+")
+
+
+class TriggerMatcher:
+    """
+    多个触发短语的单遍匹配器：所有短语编译为一个正则交替式（长短语优先），
+    一次扫描即可找出最先出现的触发短语，字间允许空白
+    """
+
+    def __init__(self, phrases):
+        self.phrases = tuple(phrases)
+        alternatives = (
+            r"\s*".join(map(re.escape, phrase))
+            for phrase in sorted(self.phrases, key=len, reverse=True)
+        )
+        self._pattern = re.compile("|".join(alternatives))
+
+    def search(self, text):
+        """
+        :return: 最先出现的触发短语的 re.Match，未找到时返回None
+        """
+        return self._pattern.search(text)
+
+    def __contains__(self, text):
+        return self._pattern.search(text) is not None
+
+
+TRIGGERS = TriggerMatcher(TRIGGER_PHRASES)
+
+
+def format_question_text(text):
+    """
+    整理OCR识别的题目文本：去除空行和尾部按钮/编号，合并被逐字拆成多行的字格
+    :return: 多行题目文本，无内容时返回空字符串
+    """
+    if not text:
+        return ""
+
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    while lines and (lines[-1] in BUTTON_WORDS or _ALNUM_LINE.fullmatch(lines[-1])):
+        lines.pop()
+    if not lines:
+        return ""
+
+    single_char_count = sum(1 for line in lines if len(line) <= 2)
+    if single_char_count >= max(1, int(len(lines) * 0.6)):
+        return ''.join(lines)
+
+    merged = []
+    buffer = []
+    for line in lines:
+        if len(line) <= 2 and not _SENTENCE_END.search(line):
+            buffer.append(line)
+        else:
+            if buffer:
+                merged.append(''.join(buffer))
+                buffer = []
+            merged.append(line)
+    if buffer:
+        merged.append(''.join(buffer))
+
+    return "\n".join(merged)
+
+
+def extract_grid_chars(text):
+    """
+    从字格区域的文本中提取候选字：第一个以按钮结尾的行之后属于界面，整体丢弃；
+    其余内容去掉按钮、题号、分数、计时和括号提示，只保留汉字
+    :return: 按出现顺序排列的候选字
+    """
+    match = _BUTTON_LINE_END.search(text)
+    if match is not None:
+        text = text[:match.start()]
+    return _NON_HAN.sub('', _GRID_NOISE.sub('', text))
+
+
+def extract_poem_chars(text):
+    """
+    解析诗词组字题，提取题目给出的候选字
+    候选字一般在触发短语之后；之后没有足够的字时（字格排在题干上方），改为取触发短语之前的字
+    :return: 候选字字符串，不是组字题时返回None
+    """
+    if not text:
+        return None
+    match = TRIGGERS.search(text)
+    if match is None:
+        return None
+
+    chars = extract_grid_chars(text[match.end():])
+    if len(chars) < MIN_GRID_CHARS:
+        before = extract_grid_chars(text[:match.start()])
+        if len(before) > len(chars):
+            chars = before
+    return chars